@@ -1,5 +1,8 @@
+import importlib
 import json
 import os
+import sys
+from collections.abc import Iterator, Mapping
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -11,6 +14,55 @@ from datamanager.schemas.abstract_schema import AbstractSchema
 # a lookup table, should we find that there are a much larger number we can use something
 # like __import__ to grab the correct objects.
 
+absolute_path = "datamanager"
+
+
+def _cached_import(module_path: str, class_name: str) -> type:
+    """Imports a class from a module, skipping the import machinery if the module is already loaded.
+
+    Args:
+        module_path: The dotted path of the module to import.
+        class_name: The name of the class inside the module.
+
+    Returns:
+        The class object.
+    """
+    module = sys.modules.get(module_path)
+    # A module that is still initializing is in sys.modules but may not have the class yet.
+    if module is None or getattr(getattr(module, "__spec__", None), "_initializing", False):
+        module = importlib.import_module(module_path)
+    return getattr(module, class_name)
+
+
+def _import_from_config(package: str, object_path: str) -> type:
+    """Imports a class from a "module.ClassName" string as written in the configuration json.
+
+    Args:
+        package: The dotted path of the package the module lives in.
+        object_path: The module and class name, for example "json_storage.JsonStorageStrategy".
+
+    Returns:
+        The class object.
+    """
+    module_name, class_name = object_path.rsplit(".", 1)
+    return _cached_import(f"{package}.{module_name}", class_name)
+
+
+class _LazySchemas(Mapping):
+    """Read-only mapping of schema names to schemas that only imports a schema when it is accessed."""
+
+    def __init__(self, config_reader: "ConfigReader") -> None:
+        self._config_reader = config_reader
+
+    def __getitem__(self, schema_name: str) -> AbstractSchema:
+        return self._config_reader.get_schema(schema_name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._config_reader._schema_specs)
+
+    def __len__(self) -> int:
+        return len(self._config_reader._schema_specs)
+
 
 @dataclass
 class ConfigReader:
@@ -18,7 +70,7 @@ class ConfigReader:
     searchStrategy: AbstractSearchStrategy
     storagePath: str
     universalSchema: AbstractSchema
-    schemas: dict[str, AbstractSchema]
+    schemas: Mapping[str, AbstractSchema]
     requiredEnvirons: dict[str, str]
     useUniversal: bool = True
 
@@ -38,15 +90,21 @@ class ConfigReader:
 
         # Just import for now, we will instantiate later but we want to seperate these
         # sections in case of bugs or if we change the way we bring them in.
-        storage_module = __import__(f"{absolute_path}.strategies.storage.{config_options['storageStrategy']}")
-        search_module = __import__(f"{absolute_path}.strategies.search.{config_options['searchStrategy']}")
+        storage_class = _import_from_config(
+            f"{absolute_path}.strategies.storage", config_options['storageStrategy']
+            )
+        search_class = _import_from_config(
+            f"{absolute_path}.strategies.search", config_options['searchStrategy']
+            )
         if "universalSchema" in config_options:
-            universal_schema_module = __import__(f"{absolute_path}.schemas.{config_options['universalSchema']}")
+            universal_schema_class = _import_from_config(
+                f"{absolute_path}.schemas", config_options['universalSchema']
+                )
         else:
-            universal_schema_module = None
-        schema_modules = {}
-        for schema_name, module in config_options["schemas"]:
-            schema_modules[schema_name] = __import__(f"{absolute_path}.schemas.{module}")
+            universal_schema_class = None
+        # Sessions usually only touch a few asset types, so schemas are imported when first used.
+        self._schema_specs: dict[str, str] = dict(config_options["schemas"])
+        self._schemas: dict[str, AbstractSchema] = {}
 
         # Set 1:1 values such as strings and the like. Do this section first so we can replace
         # certain values from the requiredEnvirons. We typically set things like the
@@ -63,13 +121,41 @@ class ConfigReader:
         # location per-pipeline.
         if "requiredEnvirons" in config_options:
             self.requiredEnvirons = config_options['requiredEnvirons']
-            for attr_name, values in self.requiredEnvirons:
+            # Look each variable up once, and fail with a clear message before touching any values.
+            needed = {value for values in self.requiredEnvirons.values() for value in values}
+            missing = sorted(needed.difference(os.environ))
+            if missing:
+                raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+            environ = {value: os.environ[value] for value in needed}
+            for attr_name, values in self.requiredEnvirons.items():
+                attr_value = getattr(self, attr_name)
                 for value in values:
-                    getattr(self, attr_name).replace("{" + value + "}", os.environ[value])
-
-        self.storageStrategy = storage_module(self.storagePath)
-        self.searchStrategy = search_module(self.storageStrategy)
-        if self.useUniversal and universal_schema_module:
-            self.universalSchema = universal_schema_module()
-        for module_name, module in schema_modules:
-            self.schemas[module_name] = module()
\ No newline at end of file
+                    token = "{" + value + "}"
+                    # Most values don't contain every token, skip building a new string for those.
+                    if token in attr_value:
+                        attr_value = attr_value.replace(token, environ[value])
+                setattr(self, attr_name, attr_value)
+
+        self.storageStrategy = storage_class(self.storagePath)
+        self.searchStrategy = search_class(self.storageStrategy)
+        if self.useUniversal and universal_schema_class:
+            self.universalSchema = universal_schema_class()
+        self.schemas = _LazySchemas(self)
+
+    def get_schema(self, schema_name: str) -> AbstractSchema:
+        """Gets a schema by name, importing and creating it on first use.
+
+        Args:
+            schema_name: The name of the schema as defined in the configuration json.
+
+        Returns:
+            The schema object.
+
+        Raises:
+            KeyError: If the schema is not defined in the configuration json.
+        """
+        schema = self._schemas.get(schema_name)
+        if schema is None:
+            schema_class = _import_from_config(f"{absolute_path}.schemas", self._schema_specs[schema_name])
+            schema = self._schemas[schema_name] = schema_class()
+        return schema
\ No newline at end of file
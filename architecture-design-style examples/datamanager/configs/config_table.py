@@ -8,7 +8,7 @@ from datamanager.strategies.storage import(
     JsonStorageStrategy,
     )
 
-@dataclass
+@dataclass(slots=True)
 class ConfigLookupTable:
     storage_strategies: dict[str, Any]
     search_strategies: dict[str, Any]
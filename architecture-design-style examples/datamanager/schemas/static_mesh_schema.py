@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class StaticMeshSchema:
     """The schema for the static mesh data."""
     mesh_names: list[str]
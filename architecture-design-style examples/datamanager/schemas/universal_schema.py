@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class UniversalSchema:
     """The universal schema that is used to define the universal schema for the data manager."""
     asset_uuid: str
@@ -1,8 +1,27 @@
+import functools
+import operator
 from abc import ABC
-from typing import Any, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Union
 
 from datamanager.strategies.storage import AbstractStorageStrategy
 
+# Fetching data is mostly waiting on the disk, so a handful of threads keeps it busy.
+_MAX_FETCH_WORKERS = 16
+
+
+@functools.lru_cache(maxsize=256)
+def _field_getter(keys: tuple[str, ...]) -> Callable[[dict[str, Any]], Any]:
+    """Gets a C implemented getter for the given keys, built once per query shape
+
+    Args:
+        keys: keys to get from the data
+
+    Returns:
+        getter returning the value for a single key or a tuple of values for several keys
+    """
+    return operator.itemgetter(*keys)
+
 
 class AbstractSearchStrategy(ABC):
     # Naive patterns that work for all storage strategies, for databases that contain
@@ -14,10 +33,21 @@ class AbstractSearchStrategy(ABC):
             storage_strategy: storage strategy to use
         """
         self._storage_strategy = storage_strategy
+        self._all_ids_cache: Union[list[str], None] = None
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._storage_strategy.register_observer(self.invalidate)
 
     # Concrete methods ###
+    def invalidate(self, asset_id: Union[str, None] = None):
+        """Drops cached data after the stored data has changed
+
+        Args:
+            asset_id: id of the asset that changed, None if unknown
+        """
+        self._all_ids_cache = None
+
     def _fetch_data(self, asset_id: str) -> dict[str, Any]:
-        """Fetches the data for the given asset id
+        """Fetches the data for the given asset id from the storage strategy
 
         Args:
             asset_id: id of the asset to fetch the data for
@@ -27,6 +57,25 @@ class AbstractSearchStrategy(ABC):
         """
         return self._storage_strategy.get(asset_id)
 
+    def _fetch_many(self, asset_ids: Iterable[str]) -> Iterator[dict[str, Any]]:
+        """Fetches the data for many asset ids, in parallel if the storage strategy allows it
+
+        Args:
+            asset_ids: ids of the assets to fetch the data for
+
+        Returns:
+            iterator of dictionaries containing the data, in the same order as the ids
+        """
+        # Repeated ids are only fetched once. The cache only lives for this call, so data changed
+        # by another process or a perforce sync is never served from it.
+        fetch = functools.lru_cache(maxsize=None)(self._fetch_data)
+        asset_ids = list(asset_ids)
+        if len(asset_ids) < 2 or not self._storage_strategy.thread_safe_reads:
+            return map(fetch, asset_ids)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=_MAX_FETCH_WORKERS)
+        return self._executor.map(fetch, asset_ids)
+
     def _get_data_id(self, data: dict[str, Any]) -> Union[str, None]:
         """Reverse lookup gets the id of the given data
 
@@ -36,9 +85,10 @@ class AbstractSearchStrategy(ABC):
         Returns:
             id of the data or None if not found
         """
-        for asset_id in self.get_all():
-            if self._fetch_data(asset_id) == data:
-                return asset_id
+        with self._storage_strategy.session():
+            for asset_id, asset_data in self._storage_strategy.iter_all(lazy = True):
+                if asset_data == data:
+                    return asset_id
         return None
 
     # noinspection PyMethodMayBeStatic
@@ -54,22 +104,54 @@ class AbstractSearchStrategy(ABC):
         """
         return all(data.get(key) == value for key, value in query.items())
 
-    def filter(self, assets: list[str], filter_criteria: dict[str, Any]) -> list[str]:
+    def _compile_query(self, query: dict[str, Any]) -> Callable[[dict[str, Any]], bool]:
+        """Builds a predicate for the given query once so it can be applied to many assets
+
+        Subclasses that override _matches_query get a predicate that calls their override.
+
+        Args:
+            query: dictionary containing the query
+
+        Returns:
+            function that returns True if the data it is given matches the query
+        """
+        if type(self)._matches_query is not AbstractSearchStrategy._matches_query:
+            return lambda data: self._matches_query(data, query)
+
+        items = tuple(query.items())
+        if not items:
+            # An empty query matches everything, and itemgetter needs at least one key.
+            return lambda data: True
+        getter = _field_getter(tuple(query))
+        expected = items[0][1] if len(items) == 1 else tuple(query.values())
+
+        def matches(data: dict[str, Any]) -> bool:
+            try:
+                return getter(data) == expected
+            except KeyError:
+                # Missing keys count as None, leave those to the naive check.
+                return self._matches_query(data, query)
+
+        return matches
+
+    def filter(self, assets: Iterable[str], filter_criteria: dict[str, Any]) -> list[str]:
         """Filters a list of assets by the given filter criteria
 
         Args:
-            assets: list of asset ids to filter
+            assets: asset ids to filter, any iterable
             filter_criteria: dictionary containing the filter criteria
 
         Returns:
             filtered asset ids
         """
-        filtered_assets = []
-        for asset in assets:
-            data = self._fetch_data(asset)
-            if self._matches_query(data, filter_criteria):
-                filtered_assets.append(asset)
-        return filtered_assets
+        matches = self._compile_query(filter_criteria)
+        # The ids are walked twice, once to fetch and once to pair with the data.
+        assets = list(assets)
+        with self._storage_strategy.session():
+            # Sync once up front so fetching each asset can read the local copy.
+            self._storage_strategy.refresh_all()
+            fetched = self._fetch_many(assets)
+            return [asset for asset, data in zip(assets, fetched) if matches(data)]
 
     def get_all(self) -> list[str]:
         """Gets all data ids
@@ -77,7 +159,9 @@ class AbstractSearchStrategy(ABC):
         Returns:
             all data ids
         """
-        return self._storage_strategy.get_all()
+        if self._all_ids_cache is None:
+            self._all_ids_cache = self._storage_strategy.get_all_ids()
+        return list(self._all_ids_cache)
 
     def search(self, query: dict[str, Any]) -> list[str]:
         """Searches for data objects that match the query
@@ -88,5 +172,10 @@ class AbstractSearchStrategy(ABC):
         Returns:
             data ids that match the query
         """
-        all_data = self.get_all()
-        return self.filter(all_data, query)
+        matches = self._compile_query(query)
+        with self._storage_strategy.session():
+            return [
+                asset_id
+                for asset_id, data in self._storage_strategy.iter_all(lazy = True)
+                if matches(data)
+                ]
@@ -1,12 +1,224 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Union
+
 from datamanager.strategies.search import AbstractSearchStrategy
+from datamanager.strategies.storage import JsonStorageStrategy
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "_index.json"
+# Bumped whenever the way values are keyed changes, older index files are rebuilt.
+INDEX_FORMAT = 2
+
+
+def _normalize_value(value: Any) -> Any:
+    """Converts values that compare equal with == into the same value
+
+    Bools and whole floats become ints, so True, 1 and 1.0 all get the same key like they match
+    in the naive search.
+
+    Args:
+        value: value to normalize
+
+    Returns:
+        normalized value
+    """
+    if isinstance(value, bool) or (isinstance(value, float) and value.is_integer()):
+        return int(value)
+    if isinstance(value, list):
+        return [_normalize_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize_value(item) for key, item in value.items()}
+    return value
+
+
+def _value_key(value: Any) -> str:
+    """Converts a value into a string that can be used as a key in the index
+
+    Args:
+        value: value to convert
+
+    Returns:
+        canonical json string of the normalized value
+    """
+    return json.dumps(_normalize_value(value), sort_keys=True)
 
 
 class JsonSearchStrategy(AbstractSearchStrategy):
     """Search strategy that searches the data in json files
 
-    The json files are the data files and all searches use the naive strategies defined in the
+    Keeps an inverted index of field -> value -> asset ids next to the data files so searches are
+    set intersections instead of reading every file. Assets the storage strategy reports as saved or
+    deleted are reindexed before the next search. The index also remembers the modified time of
+    each file it indexed, so files synced from perforce or changed by other processes are picked up
+    too. Filtering and reverse lookups use the naive strategies defined in the
     abstract search strategy.
     """
-    # Possible improvements: add a search index to speed up the search, this would require a
-    # reindexing step when the data is updated.
-    # This object is empty because the json search strategy is naive and uses the abstract search.
+
+    def __init__(self, storage_strategy: JsonStorageStrategy):
+        """Json search strategy
+
+        Args:
+            storage_strategy: json storage strategy to use
+        """
+        super().__init__(storage_strategy)
+        # The index is loaded from disk on the first search.
+        self._postings: dict[str, dict[str, set[str]]] = {}
+        self._versions: dict[str, int] = {}
+        self._indexed_keys: dict[str, list[tuple[str, str]]] = {}
+        self._index_loaded = False
+        # Changes reported by the storage strategy, applied to the index on the next search.
+        self._changed_ids: set[str] = set()
+        self._reindex_all = False
+        self._updating_index = False
+
+    def invalidate(self, asset_id: Union[str, None] = None):
+        """Marks the given asset to be reindexed before the next search
+
+        Modified times alone can miss a change, two saves within one timestamp tick look the same.
+
+        Args:
+            asset_id: id of the asset that changed, None if any asset may have changed
+        """
+        super().invalidate(asset_id)
+        if self._updating_index:
+            # The sync the index makes before it scans, anything it changed is picked up by the scan.
+            return
+        if asset_id is None:
+            self._reindex_all = True
+        else:
+            self._changed_ids.add(asset_id)
+
+    @property
+    def _index_path(self) -> Path:
+        """Path of the index file, the data path can move when perforce syncs"""
+        return Path(self._storage_strategy.data_path) / INDEX_FILE_NAME
+
+    def _load_index(self):
+        """Loads the index from disk, starting from an empty index if it is missing or unreadable"""
+        self._index_loaded = True
+        try:
+            with open(self._index_path, 'r') as file:
+                index = json.loads(file.read())
+            if index.get("format") != INDEX_FORMAT:
+                raise ValueError(f"expected format {INDEX_FORMAT}, got {index.get('format')}")
+            versions = dict(index["versions"])
+            postings = {
+                field: {value_key: set(asset_ids) for value_key, asset_ids in field_postings.items()}
+                for field, field_postings in index["postings"].items()
+                }
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning(f"Search index {self._index_path} is unreadable, rebuilding: {e}")
+            return
+        self._versions = versions
+        self._postings = postings
+        for field, field_postings in postings.items():
+            for value_key, asset_ids in field_postings.items():
+                for asset_id in asset_ids:
+                    self._indexed_keys.setdefault(asset_id, []).append((field, value_key))
+
+    def _write_index(self):
+        """Writes the index to disk"""
+        index = {
+            "format": INDEX_FORMAT,
+            "versions": self._versions,
+            "postings": {
+                field: {value_key: sorted(asset_ids) for value_key, asset_ids in postings.items()}
+                for field, postings in self._postings.items()
+                },
+            }
+        # Write to a temporary file first so a failed write never leaves a half written index.
+        temp_path = self._index_path.with_suffix(".tmp")
+        try:
+            with open(temp_path, 'w') as file:
+                file.write(json.dumps(index))
+            os.replace(temp_path, self._index_path)
+        except OSError as e:
+            # The index is rebuilt from the data files, losing it only costs time.
+            logger.warning(f"Could not write search index {self._index_path}: {e}")
+
+    def _unindex_asset(self, asset_id: str):
+        """Removes an asset from the index
+
+        Args:
+            asset_id: id of the asset to remove
+        """
+        self._versions.pop(asset_id, None)
+        for field, value_key in self._indexed_keys.pop(asset_id, ()):
+            asset_ids = self._postings[field][value_key]
+            asset_ids.discard(asset_id)
+            if not asset_ids:
+                del self._postings[field][value_key]
+
+    def _index_asset(self, asset_id: str, data: dict[str, Any], version: int):
+        """Adds an asset to the index
+
+        Args:
+            asset_id: id of the asset to add
+            data: dictionary containing the data
+            version: modified time of the asset's file
+        """
+        indexed_keys = self._indexed_keys[asset_id] = []
+        for field, value in data.items():
+            value_key = _value_key(value)
+            self._postings.setdefault(field, {}).setdefault(value_key, set()).add(asset_id)
+            indexed_keys.append((field, value_key))
+        self._versions[asset_id] = version
+
+    def _update_index(self):
+        """Reindexes every asset whose file was added, removed, or modified since it was indexed"""
+        if not self._index_loaded:
+            self._load_index()
+        # Forget the version of changed assets rather than dropping them, so deleted ones are still
+        # unindexed below.
+        for asset_id in self._versions if self._reindex_all else self._changed_ids:
+            if asset_id in self._versions:
+                self._versions[asset_id] = None
+        self._reindex_all = False
+        self._changed_ids.clear()
+
+        self._updating_index = True
+        try:
+            modified_times = self._storage_strategy.get_modified_times()
+        finally:
+            self._updating_index = False
+        changed = False
+        for asset_id in self._versions.keys() - modified_times.keys():
+            self._unindex_asset(asset_id)
+            changed = True
+        for asset_id, version in modified_times.items():
+            if self._versions.get(asset_id) != version:
+                self._unindex_asset(asset_id)
+                self._index_asset(asset_id, self._storage_strategy.get(asset_id), version)
+                changed = True
+        if changed:
+            self._write_index()
+
+    def search(self, query: dict[str, Any]) -> list[str]:
+        """Searches for data objects that match the query using the index
+
+        Args:
+            query: dictionary containing the search parameters
+
+        Returns:
+            data ids that match the query
+        """
+        # A None value also matches assets that are missing the field, which the index can't
+        # answer, so leave those to the naive search.
+        if not query or any(value is None for value in query.values()):
+            return super().search(query)
+
+        with self._storage_strategy.session():
+            self._update_index()
+        matches = None
+        for field, value in query.items():
+            asset_ids = self._postings.get(field, {}).get(_value_key(value), set())
+            matches = set(asset_ids) if matches is None else matches & asset_ids
+            if not matches:
+                return []
+        return list(matches)
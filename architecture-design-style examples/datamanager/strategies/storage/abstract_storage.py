@@ -1,12 +1,20 @@
 import contextlib
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any
+from collections.abc import Mapping
+from typing import Any, Callable, Iterator, Optional
 
 
 class AbstractStorageStrategy(ABC):
     """Abstract class for storage strategies"""
 
+    # Whether get can safely be called from several threads at once, search strategies use this
+    # to decide if they can fetch data in parallel.
+    thread_safe_reads = False
+
+    def __init__(self):
+        self._observers: list[Callable[[Optional[str]], None]] = []
+
     # Concrete methods ###
     @contextlib.contextmanager
     def edit(self, asset_id: str) -> dict[str, Any]:
@@ -22,6 +30,58 @@ class AbstractStorageStrategy(ABC):
         yield data
         self.save(asset_id, data)
 
+    def iter_all(self, lazy: bool = False) -> Iterator[tuple[str, Mapping[str, Any]]]:
+        """Iterates over all data
+
+        Naive implementation that fetches each id one at a time, storage strategies that can
+        read everything in one pass should override this.
+
+        Arguments:
+            lazy: allow the storage strategy to yield read-only views that are only valid until
+                the next item is requested, instead of fully parsed dictionaries
+
+        Yields:
+            tuples of asset id and the dictionary containing its data
+        """
+        for asset_id in self.get_all_ids():
+            yield asset_id, self.get(asset_id)
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[None]:
+        """Context manager to group many storage calls into one operation
+
+        Does nothing by default, storage strategies that connect to a server should override this
+        to hold a single connection open for the whole block.
+        """
+        yield
+
+    def refresh_all(self):
+        """Refreshes the local copy of all data
+
+        Does nothing by default, storage strategies that read from a local copy of remote data
+        should override this so searches can sync once up front instead of once per asset.
+        """
+
+    def register_observer(self, callback: Callable[[Optional[str]], None]):
+        """Registers a callback to be notified when data changes
+
+        Used by search strategies to invalidate anything they have cached.
+
+        Args:
+            callback: called with the id of the asset that was saved or deleted, or None when any
+                data may have changed, such as after a refresh
+        """
+        self._observers.append(callback)
+
+    def _notify_observers(self, asset_id: Optional[str]):
+        """Notifies all registered observers that the data for the given asset id changed
+
+        Args:
+            asset_id: id of the asset that changed, None if any asset may have changed
+        """
+        for callback in self._observers:
+            callback(asset_id)
+
     @staticmethod
     def generate_id() -> str:
         """Generates a new id
@@ -1,14 +1,91 @@
+import contextlib
+import hashlib
 import logging
+import mmap
 import os
-from json import dumps, loads
+from collections.abc import Mapping
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
 from datamanager.strategies.storage.abstract_storage import AbstractStorageStrategy
 from shared.version_control import perforce
 
+try:
+    from orjson import OPT_NON_STR_KEYS, OPT_SORT_KEYS, dumps as _orjson_dumps, loads
+
+    # orjson rejects non str keys unless asked, the standard library turns them into strings.
+    def dumps(data: Any) -> bytes:
+        return _orjson_dumps(data, option = OPT_NON_STR_KEYS)
+
+    def _dumps_sorted(data: Any) -> bytes:
+        return _orjson_dumps(data, option = OPT_SORT_KEYS | OPT_NON_STR_KEYS)
+except ImportError:
+    # orjson is optional, fall back to the standard library. Both paths read and write bytes
+    # so the rest of the module doesn't need to care which one we got.
+    from json import dumps as _json_dumps, loads as _json_loads
+
+    def dumps(data: Any) -> bytes:
+        return _json_dumps(data).encode()
+
+    def loads(data: Any) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return _json_loads(data)
+
+    def _dumps_sorted(data: Any) -> bytes:
+        return _json_dumps(data, sort_keys = True).encode()
+
+try:
+    import simdjson
+except ImportError:
+    # Only used to speed up iterating over every asset, we parse everything up front without it.
+    simdjson = None
+
 logger = logging.getLogger(__name__)
 
+# Files bigger than this are memory mapped and parsed in place instead of being read into a copy.
+_MMAP_THRESHOLD = 64 * 1024
+
+
+def _hash_data(data: dict[str, Any]) -> bytes:
+    """Hashes the data so two dictionaries with the same content get the same digest
+
+    Args:
+        data: dictionary containing the data
+
+    Returns:
+        digest of the data
+    """
+    return hashlib.blake2b(_dumps_sorted(data), digest_size = 16).digest()
+
+
+class _LazyDocument(Mapping):
+    """Read-only view over a simdjson document that only converts the fields that are read
+
+    The view stops working once the document it wraps is released.
+    """
+
+    def __init__(self, document: "simdjson.Object"):
+        self._document = document
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._document[key]
+        if isinstance(value, simdjson.Array):
+            return value.as_list()
+        if isinstance(value, simdjson.Object):
+            return value.as_dict()
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._document.keys())
+
+    def __len__(self) -> int:
+        return len(self._document)
+
+    def release(self):
+        """Drops the reference to the document so the parser can be reused"""
+        self._document = None
+
 
 class JsonStorageStrategy(AbstractStorageStrategy):
     def __init__(
@@ -25,15 +102,33 @@ class JsonStorageStrategy(AbstractStorageStrategy):
         Raises:
             ValueError: if the data_path is not a valid path
         """
+        super().__init__()
         self.use_p4 = use_p4
         self.depot_path = None
         self.client = None
+        # Digest of the data last saved or compared against per asset, lets save skip no-op writes
+        # without going back to disk. Cleared whenever the local copy may have changed under us.
+        self._content_hashes: dict[str, bytes] = {}
+        # Once the whole directory has been synced inside a session, get only syncs files we know are
+        # out of date until that session closes.
+        self._synced_in_session = False
+        self._stale: set[str] = set()
+        # How many sessions are currently open, only the outermost one connects to perforce.
+        self._session_depth = 0
         if self.use_p4:
             self.depot_path = data_path
             self.client = perforce.get_hosted_assets_client()
             self._get_latest_all()
         else:
             self.data_path = Path(data_path)
+            # Joining strings per asset is much cheaper than building a Path per asset. A plain prefix
+            # rather than a format template, so braces in the data path are left alone.
+            self._path_prefix = os.path.join(str(self.data_path), "")
+
+    @property
+    def thread_safe_reads(self) -> bool:
+        """Reading local json files is thread safe, the perforce client is not known to be"""
+        return not self.use_p4
 
     @staticmethod
     def _initialize_data_directory_in_perforce(path: str):
@@ -59,7 +154,7 @@ class JsonStorageStrategy(AbstractStorageStrategy):
                 if not os.path.exists(data_path):
                     os.makedirs(data_path)
                 if not os.listdir(data_path):
-                    with open(filepath, "w") as f:
+                    with open(filepath, "wb") as f:
                         f.write(dumps({}))
                     logger.debug("Trying to add to depot.")
                     perforce.add_to_depot(
@@ -78,14 +173,98 @@ class JsonStorageStrategy(AbstractStorageStrategy):
             ValueError: if the data_path is not a valid path
         """
         if self.use_p4:
-            self.client = perforce.get_hosted_assets_client()
-            with perforce.connected(client = self.client):
+            in_session = bool(self._session_depth)
+            if not in_session:
+                self.client = perforce.get_hosted_assets_client()
+            with self.session():
                 self.data_path = Path(perforce.convert_paths_to_local_path(self.depot_path)[0])
                 if not self.data_path.exists():
                     exists = perforce.exists_in_depot(self.depot_path)
                     if not exists:
                         raise ValueError(f'{self.data_path} is not a valid path')
+                self._path_prefix = os.path.join(str(self.data_path), "")
                 perforce.get_latest(self.depot_path + '/...')
+            # Only trust the local copy for the rest of the caller's session, a sync made outside
+            # of one could be arbitrarily old by the time the next get comes around.
+            self._synced_in_session = in_session
+            self._stale.clear()
+            # The sync may have pulled in anyone's changes, so nothing cached from before is valid.
+            self._content_hashes.clear()
+            self._notify_observers(None)
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[None]:
+        """Holds one perforce connection open for everything done inside the block
+
+        Sessions are reentrant, nested sessions and the storage calls made inside the block reuse
+        the outer connection instead of connecting again.
+        """
+        if not self.use_p4 or self._session_depth:
+            connection = contextlib.nullcontext()
+        else:
+            connection = perforce.connected(client = self.client)
+        with connection:
+            self._session_depth += 1
+            try:
+                yield
+            finally:
+                self._session_depth -= 1
+                if not self._session_depth:
+                    self._synced_in_session = False
+
+    def mark_stale(self, asset_id: str):
+        """Marks the local copy of the given asset as out of date
+
+        The next get for the asset will get the latest from perforce.
+
+        Args:
+            asset_id: id of the asset that is out of date
+        """
+        self._stale.add(asset_id)
+        self._content_hashes.pop(asset_id, None)
+        self._notify_observers(asset_id)
+
+    def refresh_all(self):
+        """Gets the latest version of the data directory from perforce"""
+        self._get_latest_all()
+
+    def _scan_data_files(self) -> list[os.DirEntry]:
+        """Lists the directory entries of all data files in the local data directory
+
+        Uses scandir so the file type comes from the directory listing instead of a stat per file.
+        Files starting with an underscore are reserved for metadata such as search indexes.
+
+        Returns:
+            list of directory entries
+        """
+        with os.scandir(self.data_path) as entries:
+            return [
+                entry
+                for entry in entries
+                if entry.name.endswith(".json")
+                and not entry.name.startswith("_")
+                and entry.is_file(follow_symlinks = False)
+                ]
+
+    def _scan_ids(self) -> list[str]:
+        """Lists the ids of all json files in the local data directory
+
+        Returns:
+            list of all data ids
+        """
+        return [entry.name[:-5] for entry in self._scan_data_files()]
+
+    def get_modified_times(self) -> dict[str, int]:
+        """Gets the last modified time of every data file
+
+        Lets callers that keep derived data, like a search index, find out what changed without
+        reading every file.
+
+        Returns:
+            dictionary of asset id to the modified time of its file in nanoseconds
+        """
+        self.refresh_all()
+        return {entry.name[:-5]: entry.stat().st_mtime_ns for entry in self._scan_data_files()}
 
     def delete(self, asset_id: str) -> bool:
         """Deletes the data for the given asset id
@@ -96,11 +275,11 @@ class JsonStorageStrategy(AbstractStorageStrategy):
         Returns:
             True if the data was deleted successfully, False otherwise
         """
-        path = str(self.data_path / f"{asset_id}.json")
+        path = f"{self._path_prefix}{asset_id}.json"
         if self.use_p4:
             if not os.path.exists(path):
                 return False
-            with perforce.connected(client = self.client):
+            with self.session():
                 if not perforce.exists_in_depot(path):
                     return False
                 changelist = perforce.make_changelist(
@@ -115,7 +294,12 @@ class JsonStorageStrategy(AbstractStorageStrategy):
                 perforce.clean_empty_changelists()
 
         else:
-            os.remove(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+        self._content_hashes.pop(asset_id, None)
+        self._notify_observers(asset_id)
         return True
 
     def get(self, asset_id: str) -> dict[str, Any]:
@@ -127,14 +311,22 @@ class JsonStorageStrategy(AbstractStorageStrategy):
         Returns:
             dictionary containing the data
         """
-        path = self.data_path / f"{asset_id}.json"
-        if self.use_p4:
-            with perforce.connected(client = self.client):
+        path = f"{self._path_prefix}{asset_id}.json"
+        # Inside a session that already synced the directory the local copy is current, unless the
+        # asset was marked stale. Anywhere else get the latest so edits start from the depot version.
+        if self.use_p4 and (not self._synced_in_session or asset_id in self._stale):
+            with self.session():
                 perforce.get_latest(path)
-        if not os.path.exists(path):
+            self._stale.discard(asset_id)
+        try:
+            with open(path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size <= _MMAP_THRESHOLD:
+                    return loads(file.read())
+                with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as view:
+                        return loads(view)
+        except FileNotFoundError:
             return {}
-        with open(path, 'r') as file:
-            return loads(file.read())
 
     def get_all_ids(self) -> list[str]:
         """Gets all data ids
@@ -142,12 +334,37 @@ class JsonStorageStrategy(AbstractStorageStrategy):
         Returns:
             list of all data ids
         """
-        self._get_latest_all()
-        ids = []
-        for path in self.data_path.glob("*.json"):
-            if path.is_file():
-                ids.append(str(path.stem.rstrip(".json")))
-        return ids
+        self.refresh_all()
+        return self._scan_ids()
+
+    def iter_all(self, lazy: bool = False) -> Iterator[tuple[str, Mapping[str, Any]]]:
+        """Iterates over all data in a single pass over the data directory
+
+        Syncs the whole directory once instead of getting the latest of each file.
+
+        Args:
+            lazy: if simdjson is installed, yield read-only views that only convert the fields
+                that are accessed. Each view is only valid until the next item is requested.
+
+        Yields:
+            tuples of asset id and the data
+        """
+        self.refresh_all()
+        if not lazy or simdjson is None:
+            for asset_id in self._scan_ids():
+                with open(f"{self._path_prefix}{asset_id}.json", 'rb') as file:
+                    yield asset_id, loads(file.read())
+            return
+
+        parser = simdjson.Parser()
+        for asset_id in self._scan_ids():
+            with open(f"{self._path_prefix}{asset_id}.json", 'rb') as file:
+                document = _LazyDocument(parser.parse(file.read()))
+            try:
+                yield asset_id, document
+            finally:
+                # simdjson won't parse again while a document from the last parse is still alive.
+                document.release()
 
     def save(self, asset_id: str, data: dict[str, Any]) -> bool:
         """Saves the data for the given asset id
@@ -159,24 +376,31 @@ class JsonStorageStrategy(AbstractStorageStrategy):
         Returns:
             True if the data was saved successfully, False otherwise
         """
-        current_data = self.get(asset_id)
-        if current_data == data:
+        new_hash = _hash_data(data)
+        current_hash = self._content_hashes.get(asset_id)
+        if current_hash is None:
+            # First save of this asset in this session, compare against what is on disk once.
+            current_hash = self._content_hashes[asset_id] = _hash_data(self.get(asset_id))
+        if current_hash == new_hash:
             if not data:
                 reason = "empty"
             else:
                 reason = "already up to date"
             logger.info(f"Data for asset {asset_id} is {reason}. No save necessary.")
             return True
-        path = str(self.data_path / f"{asset_id}.json")
+        path = f"{self._path_prefix}{asset_id}.json"
 
         try:
             if self.use_p4:
-                with perforce.connected(client = self.client):
-                    if not os.path.exists(path):
-                        with open(path, 'w') as file:
+                with self.session():
+                    try:
+                        with open(path, 'xb') as file:
                             # We want to submit an empty file to perforce so that we can
                             # normalize the process.
                             file.write(dumps({}))
+                    except FileExistsError:
+                        pass
+                    else:
                         perforce.add_to_depot(path, submit_files = True)
                     perforce.clean_empty_changelists()
                     perforce.get_latest(path)
@@ -190,9 +414,11 @@ class JsonStorageStrategy(AbstractStorageStrategy):
                                 "it is exclusively checked out."
                                 )
                         logger.error(f"Error: {e}")
+                        # Someone else is editing it, make sure we pick up their changes.
+                        self.mark_stale(asset_id)
                         return False
 
-                    with open(path, 'w') as file:
+                    with open(path, 'wb') as file:
                         file.write(dumps(data))
 
                     perforce.submit(
@@ -201,8 +427,11 @@ class JsonStorageStrategy(AbstractStorageStrategy):
                             clean_up_empty_changelist = True
                             )
             else:
-                with open(path, 'w') as file:
+                with open(path, 'wb') as file:
                     file.write(dumps(data))
         except IOError as e:
             logger.error(f"Error saving data: {e}")
             return False
+        self._content_hashes[asset_id] = new_hash
+        self._notify_observers(asset_id)
+        return True
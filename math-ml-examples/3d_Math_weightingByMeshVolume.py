@@ -11,106 +11,134 @@ it is important that the volumes be named in this way, as they are considered th
 
 Run the volumeBindWindow gui and bind to joint by volume.
 
+The weights are set through the API in a single call, which can't be undone like skinPercent can. Save the scene
+before binding if you may want the old weights back. Influences with locked weights keep their weights, the rest of
+each vert's weight is shared between the unlocked influences.
 
 """
 import math
-
+import re
+
+import numpy as np
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+try:
+    import trimesh
+    from trimesh.ray import has_embree
+except ImportError:
+    trimesh = None
+    has_embree = False
 import maya.OpenMaya as OpenMaya
+import maya.OpenMayaAnim as OpenMayaAnim
 import maya.cmds as cmds
 import maya.mel as mel
 
+# Below this a segment is treated as parallel to a triangle and can't cross it.
+PARALLEL_EPSILON = 1e-9
+# Volumes with at least this many triangles are hashed into a grid instead of testing every vert
+# against every triangle.
+GRID_MIN_TRIANGLES = 256
+# The progress bar is stepped once per this many triangles or verts, every edit is a round trip to maya.
+PROGRESS_STEP = 64
+# "BindVolume_For_Joint_" + joint name + "_" + number, the joint name itself can contain underscores.
+VOLUME_NAME_PATTERN = re.compile(r"^BindVolume_For_Joint_(.+)_[^_]+$")
 
-class IncorrectSceneSetup(Exception):
-    def __init__(self, value):
-        self.value = value
-
-    def __str__(self):
-        return repr(self.value)
-
-
-class Vector(list):
-    def __init__(self, data):
-        super(Vector, self).__init__(data)
-        self.data = data
-
-    def __repr__(self):
-        return repr(self.data)
-
-    def __add__(self, other):
-
-        data = []  # start with an empty list
-
-        for j in range(len(self.data)):
-            data.append(self.data[j] + other.data[j])
-
-        return Vector(data)
 
-    def __sub__(self, other):
+def toIntArray(values):
+    # Copy values into an MIntArray that is sized up front, instead of growing it one append at a time.
+    array = OpenMaya.MIntArray(len(values), 0)
+    for i, value in enumerate(values):
+        array.set(int(value), i)
+    return array
 
-        data = []  # start with an empty list
 
-        for j in range(len(self.data)):
-            data.append(self.data[j] - other.data[j])
+def toDoubleArray(values):
+    # Copy values into an MDoubleArray that is sized up front, instead of growing it one append at a time.
+    array = OpenMaya.MDoubleArray(len(values), 0.0)
+    for i, value in enumerate(values):
+        array.set(float(value), i)
+    return array
 
-        return Vector(data)
 
-    def __mul__(self, other):
-
-        data = []  # start with an empty list
-
-        for j in range(len(self.data)):
-            data.append(self.data[j] * other.data[j])
-
-        return Vector(data)
-
-    def __div__(self, other):
-
-        data = []  # start with an empty list
-
-        for j in range(len(self.data)):
-            data.append(self.data[j] / other.data[j])
-
-        return Vector(data)
-
-    def __getitem__(self, index):
-        return self.data[index]
+class IncorrectSceneSetup(Exception):
+    def __init__(self, value):
+        self.value = value
 
-    def __len__(self):
-        return len(self.data)
+    def __str__(self):
+        return repr(self.value)
 
 
-def dot_product(v, w):
+def ray_hits_triangle(orig, direction, vertA, vertB, vertC):
     """
-    v and w are points of [x,y,z] that can be multiplied together, It returns an integer.
+    Moller-Trumbore test of the segments orig -> orig + direction against the triangles vertA, vertB, vertC.
+    Every argument is an [x, y, z] or an (N, 3) array, they broadcast against each other.
+    Returns a boolean array that is True where the segment crosses its triangle.
     """
-    # (P1x * P2x) + (P1y * P2y) + (p1z * p2z)
-    return v[0] * w[0] + v[1] * w[1] + v[2] * w[2]
-
-
-def cross_product(v, w):
+    # Solve for the barycentric coordinates (u, v) of where the segment meets the triangle's plane
+    # and how far along the segment (t) that happens.
+    edge1 = vertB - vertA
+    edge2 = vertC - vertA
+    h = np.cross(direction, edge2)
+    a = (edge1 * h).sum(axis=-1)
+    # Segments parallel to the triangle divide by 0, they are filtered out by the epsilon test below.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f = 1.0 / a
+        s = orig - vertA
+        u = f * (s * h).sum(axis=-1)
+        q = np.cross(s, edge1)
+        v = f * (direction * q).sum(axis=-1)
+        t = f * (edge2 * q).sum(axis=-1)
+
+    return ((np.abs(a) > PARALLEL_EPSILON) & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) &
+            (t >= 0.0) & (t <= 1.0))
+
+
+def _count_hits(verts, center, triVertsA, triVertsB, triVertsC):
     """
-    v and w are points of [x,y,z] that can be multiplied together, it returns a tupple.
+    Counts how many of the triangles each segment from a vert to the center crosses. This is the same
+    Moller-Trumbore test as ray_hits_triangle, written out as loops so numba can compile it into one kernel
+    that runs the verts in parallel, without the temporary arrays numpy needs.
     """
-    # x = (p1y * p2z) - (p1z * p2y)
-    # y = (p1z * p2x) - (p1x * p2z)
-    # z = (p1x * p2y) - (p1y * p2x)
-    # return x, y, z
-    x = v[1] * w[2] - v[2] * w[1]
-    y = v[2] * w[0] - v[0] * w[2]
-    z = v[0] * w[1] - v[1] * w[0]
+    counts = np.zeros(verts.shape[0], dtype=np.int32)
+    for i in prange(verts.shape[0]):
+        ox, oy, oz = verts[i, 0], verts[i, 1], verts[i, 2]
+        dx, dy, dz = center[0] - ox, center[1] - oy, center[2] - oz
+        for j in range(triVertsA.shape[0]):
+            ax, ay, az = triVertsA[j, 0], triVertsA[j, 1], triVertsA[j, 2]
+            e1x, e1y, e1z = triVertsB[j, 0] - ax, triVertsB[j, 1] - ay, triVertsB[j, 2] - az
+            e2x, e2y, e2z = triVertsC[j, 0] - ax, triVertsC[j, 1] - ay, triVertsC[j, 2] - az
+
+            hx, hy, hz = dy * e2z - dz * e2y, dz * e2x - dx * e2z, dx * e2y - dy * e2x
+            a = e1x * hx + e1y * hy + e1z * hz
+            if abs(a) <= PARALLEL_EPSILON:
+                continue
+            f = 1.0 / a
+            sx, sy, sz = ox - ax, oy - ay, oz - az
+            u = f * (sx * hx + sy * hy + sz * hz)
+            if u < 0.0 or u > 1.0:
+                continue
+            qx, qy, qz = sy * e1z - sz * e1y, sz * e1x - sx * e1z, sx * e1y - sy * e1x
+            v = f * (dx * qx + dy * qy + dz * qz)
+            if v < 0.0 or u + v > 1.0:
+                continue
+            t = f * (e2x * qx + e2y * qy + e2z * qz)
+            if 0.0 <= t <= 1.0:
+                counts[i] += 1
+    return counts
 
-    return (x, y, z)
 
-
-def normalizeNormal(v):
-    """
-    v is a normal, which is a vector of [x, y, z] we will take the squareroot of each of these to get the normalisation
-    factor, then divide each of these by the normalisation factor.
-    """
-    addedSquares = ((v[0] ** 2) + (v[1] ** 2) + (v[2] ** 2))
-    normalizeFactor = math.sqrt(addedSquares)
-    normalizedNormal = [v[0] / normalizeFactor, v[1] / normalizeFactor, v[2] / normalizeFactor]
-    return normalizedNormal
+# Without numba the collision test falls back to numpy.
+if njit is not None:
+    try:
+        count_hits = njit(parallel=True, fastmath=True, cache=True)(_count_hits)
+    except RuntimeError:
+        # Caching needs a source file to key on, there is none when the script is run from the script editor.
+        count_hits = njit(parallel=True, fastmath=True)(_count_hits)
+else:
+    count_hits = None
 
 
 class MeshVolume(object):
@@ -118,6 +146,11 @@ class MeshVolume(object):
         self.volumesInScene = None
         self.jointsInScene = None
         self.skinClust = skinClust
+        # World space positions of every vert of a mesh as a numpy array, keyed by mesh name.
+        # See getMeshPoints.
+        self.meshPoints = {}
+        # The center of each volume, keyed by volume name. See getVolumeCenter.
+        self.volumeCenterCache = {}
 
         self.get_joints_in_scene()
         self.getVolumesInScene()
@@ -145,6 +178,87 @@ class MeshVolume(object):
             raise
         self.bindByVolume()
 
+    def getMeshPoints(self, mesh):
+        # Get all of the points of a mesh with a single API call instead of calling cmds.pointPosition
+        # for every vert. The meshes don't move while we bind, so each mesh is only fetched once.
+        if mesh not in self.meshPoints:
+            pointArray = OpenMaya.MPointArray()
+            if mesh in self.volumeDagPaths:
+                dagPath = self.volumeDagPaths[mesh]
+            else:
+                dagPath = self.getDagPath(mesh)
+            OpenMaya.MFnMesh(dagPath).getPoints(pointArray, OpenMaya.MSpace.kWorld)
+
+            self.meshPoints[mesh] = np.array(
+                [(pointArray[i].x, pointArray[i].y, pointArray[i].z) for i in range(pointArray.length())],
+                dtype=np.float64)
+
+        return self.meshPoints[mesh]
+
+    def getDagPath(self, node):
+        # Look up the MDagPath of a node by name, the API function sets need it instead of the name.
+        selectionList = OpenMaya.MSelectionList()
+        OpenMaya.MGlobal.getSelectionListByName(node, selectionList)
+        dagPath = OpenMaya.MDagPath()
+        selectionList.getDagPath(0, dagPath)
+        return dagPath
+
+    def getSkinClusterInfluences(self):
+        # Create self.skinClusterFn and return a dictionary of joint name to its influence index in the skin cluster,
+        # the weights we hand to the skin cluster are ordered by these indices.
+        selectionList = OpenMaya.MSelectionList()
+        OpenMaya.MGlobal.getSelectionListByName(self.skinClust, selectionList)
+        skinClusterNode = OpenMaya.MObject()
+        selectionList.getDependNode(0, skinClusterNode)
+        self.skinClusterFn = OpenMayaAnim.MFnSkinCluster(skinClusterNode)
+
+        influences = OpenMaya.MDagPathArray()
+        self.skinClusterFn.influenceObjects(influences)
+        influenceIndices = {influences[i].partialPathName(): i for i in range(influences.length())}
+
+        # skinPercent leaves influences with locked weights alone, setSkinWeights does the same with these.
+        self.lockedInfluences = [index for name, index in influenceIndices.items()
+                                 if cmds.attributeQuery("liw", node=name, exists=True) and
+                                 cmds.getAttr(name + ".liw")]
+        return influenceIndices
+
+    def getVertComponents(self, vertIndices):
+        # Build the vert component the API function sets take instead of a list of vert names.
+        componentFn = OpenMaya.MFnSingleIndexedComponent()
+        components = componentFn.create(OpenMaya.MFn.kMeshVertComponent)
+        componentFn.addElements(toIntArray(vertIndices))
+        return components
+
+    def setSkinWeights(self, vertIndices, weights):
+        # Set the weights of all of the verts with a single API call, instead of a skinPercent command per vert.
+        # weights has a row for each vert in vertIndices and a column for each influence of the skin cluster,
+        # every row adds up to 1.
+        dagPath = self.getDagPath(self.skinnedMesh)
+        vertIndices = np.asarray(vertIndices)
+        unlocked = [i for i in range(weights.shape[1]) if i not in self.lockedInfluences]
+        weights = weights[:, unlocked]
+
+        if self.lockedInfluences:
+            # The locked influences keep what they have, the unlocked ones share what is left of each vert.
+            lockedArray = OpenMaya.MDoubleArray()
+            self.skinClusterFn.getWeights(dagPath, self.getVertComponents(vertIndices),
+                                          toIntArray(self.lockedInfluences), lockedArray)
+            lockedWeights = np.array([lockedArray[i] for i in range(lockedArray.length())])
+            lockedTotals = lockedWeights.reshape(len(vertIndices), -1).sum(axis=1)
+
+            # Verts that are only inside volumes of locked joints are left alone.
+            totals = weights.sum(axis=1)
+            keep = totals > 0
+            vertIndices = vertIndices[keep]
+            weights = weights[keep] * ((1.0 - lockedTotals[keep]) / totals[keep])[:, None]
+            if not len(vertIndices):
+                return
+
+        # The API wants the weights of the first vert for every influence, then the second vert and so on.
+        # The rows already add up to 1 with the locked weights, so don't let maya normalize them again.
+        self.skinClusterFn.setWeights(dagPath, self.getVertComponents(vertIndices), toIntArray(unlocked),
+                                      toDoubleArray(weights.ravel().tolist()), False)
+
     def get_joints_in_scene(self):
         # Gather a list of joints we will be testing.
         self.jointsInScene = cmds.ls(type="joint")
@@ -177,16 +291,27 @@ class MeshVolume(object):
 
         self.volumesInScene = listOfVolumes
 
+        # Look up the shape of every volume once, we go back to them for their points and triangles.
+        self.volumeDagPaths = {}
+        for volume in listOfVolumes:
+            dagPath = self.getDagPath(volume)
+            dagPath.extendToShape()
+            self.volumeDagPaths[volume] = dagPath
+
+        # Work out which joint each volume affects once, instead of splitting its name every time we need it.
+        # Volumes that aren't named correctly map to None and won't match any joint.
+        self.volumeToJoint = {}
+        for volume in listOfVolumes:
+            match = VOLUME_NAME_PATTERN.match(volume)
+            self.volumeToJoint[volume] = match.group(1) if match else None
+
     def getJointsToWeight(self):
         # Compare the Volumes with the Joints, only those joints that have a volume will be returned as a list.
+        jointsWithVolumes = set(self.volumeToJoint.values())
         jointsToReturn = []
         for jointNode in self.jointsInScene:
-            for volume in self.volumesInScene:
-                splitName = volume.split("_")
-                jointName = "_".join(splitName[3:-1])
-
-                if jointNode == jointName:
-                    jointsToReturn.append(jointNode)
+            if jointNode in jointsWithVolumes:
+                jointsToReturn.append(jointNode)
 
         self.jointsToWeight = jointsToReturn
 
@@ -226,8 +351,7 @@ class MeshVolume(object):
         volumesToReturn = []
 
         for volume in self.volumesInScene:
-            splitName = volume.split("_")
-            jointName = "_".join(splitName[3:-1])
+            jointName = self.volumeToJoint[volume]
 
             if jointName not in self.jointsToWeight:
                 print("Volume " + str(volume) + " has no affected joints. Skipped.")
@@ -238,121 +362,64 @@ class MeshVolume(object):
 
     def getAllVerts(self):
         # Gather all verts in the scene to compare against the volume triangles.
-        vertsToReturn = []
-
-        meshTransform = str(cmds.listRelatives(self.skinnedMesh, ap=True)[0])
+        # Verts are kept as indices, their names are only built when maya needs them, see getVertName.
+        self.meshTransform = str(cmds.listRelatives(self.skinnedMesh, ap=True)[0])
 
+        # polyEvaluate returns the number of verts, so the indices run from 0 to one less than that.
         vertCount = cmds.polyEvaluate(self.skinnedMesh, v=True)
+        self.vertIndices = np.arange(vertCount, dtype=np.int32)
 
-        while (vertCount >= 0):
-            vertsToReturn.append(meshTransform + ".vtx[" + str(vertCount) + "]")
-            vertCount = vertCount - 1
-
-        self.vertsOfSkinnedMesh = vertsToReturn
+    def getVertName(self, vertIndex):
+        # Everything works on vert indices, maya only needs the name when we hand it the vert.
+        return self.meshTransform + ".vtx[" + str(vertIndex) + "]"
 
     def checkBoundingBox(self):
         # If there are verts outside of the bounding box then they cannot
         # be inside of the volume.
 
-        vertsToReturn = []
-
         # returns [xmin, ymin, zmin, xmax, ymax, zmax]
         boundingBox = cmds.exactWorldBoundingBox(self.currentVolume)
+        bbMin = np.array(boundingBox[:3])
+        bbMax = np.array(boundingBox[3:])
 
-        for vert in self.vertsOfSkinnedMesh:
-            vertPos = cmds.pointPosition(vert, w=True)
-            if vertPos[0] > boundingBox[0] and vertPos[1] > boundingBox[1] and vertPos[2] > boundingBox[2] and vertPos[
-                0] < boundingBox[3] and vertPos[1] < boundingBox[4] and vertPos[2] < boundingBox[5]:
-                vertsToReturn.append(vert)
+        # Test all of the cached vert positions against the box at once.
+        inBoundingBox = np.all((self.vertPositions > bbMin) & (self.vertPositions < bbMax), axis=1)
+        bbIndices = np.flatnonzero(inBoundingBox)
 
-        self.vertsInBoundingBox = vertsToReturn
+        self.vertsInBoundingBox = self.vertIndices[bbIndices]
+        self.bbVertPositions = self.vertPositions[bbIndices]
 
     def createVertDictionary(self):
         # Create a dictionary of all verts in scene, the key is the vert #, the value is blank for now.
         # We will fill it up later on whether it intersects or not.
         self.allVerts = {}
-        for vert in self.vertsOfSkinnedMesh:
+        for vert in self.vertIndices.tolist():
             self.allVerts[vert] = []
 
     def createDictOfIntersectCount(self):
-        self.intersectCount = {}
-
-        for vert in self.vertsInBoundingBox:
-            self.intersectCount[vert] = 0
+        # One counter per bounding box vert, in the same order as self.vertsInBoundingBox.
+        self.intersectCount = np.zeros(len(self.vertsInBoundingBox), dtype=np.int32)
 
     def getTrianglesInVolume(self):
         # Gather triangles of the current volume.
-        self.trianglesInVolume = []
-
-        # I use OpenMaya to get the list of triangles quickly.
+        # I use OpenMaya to get the list of triangles quickly, MFnMesh.getTriangles hands back every triangle
+        # of the mesh in one call. triangleCounts is the number of triangles in each polygon, triangleVertices
+        # is the vert numbers of all of the triangles, three after another.
+        triangleCounts = OpenMaya.MIntArray()
+        triangleVertices = OpenMaya.MIntArray()
+        OpenMaya.MFnMesh(self.volumeDagPaths[self.currentVolume]).getTriangles(triangleCounts, triangleVertices)
 
-        # Create an empty list, MSelectionList is not actually what is selected,
-        # It is just a list of MObjects, probably DAG nodes.
-        selectionList = OpenMaya.MSelectionList()
-
-        # MGlobal.getSelectionListByName("string", MSelectionList) grabs a dag object named "string"
-        # and adds it to the MSelectionList.
-        OpenMaya.MGlobal.getSelectionListByName(self.currentVolume, selectionList)
-
-        # MItSelectionList takes a MSelectionList object, and makes it iterable,
-        # Maya claims it iterates through that selection list, but really it requires
-        # more input from you to iterate.
-        # MFn.kGeometric is asking it to only iter through the shape node geometry.
-        # We have to use MItSelectionList so we can only get the shape node
-        # And so we can use the method getDependnode in MItSelectionList as well.
-        iterList = OpenMaya.MItSelectionList(selectionList, OpenMaya.MFn.kGeometric)
-
-        while not iterList.isDone():
-
-            # create an empty MObject to fill up.
-            mObj = OpenMaya.MObject()
-
-            # MItSelectionList().getDependnode(MObject) will get the dependency node
-            # Of the current object of the iterate.
-            iterList.getDependNode(mObj)
-
-            # The dependency node itself is a list of objects, we want to gather all of the
-            # polygon data in this node, and make an iterable list.
-            # MItMeshPolygon(MObject) does this.
-
-            itMeshPolygon = OpenMaya.MItMeshPolygon(mObj)
-
-            # We now need to iterate through all of the polygon data.
-            while not itMeshPolygon.isDone():
-                # Make some empty arrays and objects in maya, things that the API needs to fill.
-                pointArray = OpenMaya.MPointArray()
-                # Create an Int array, these are the vert numbers of the triangle in maya. This is what
-                # We are going to use later.
-                vertexList = OpenMaya.MIntArray()
-                # We are in object space, so we set MSpace.kObject
-                space = OpenMaya.MSpace.kObject
-
-                # Get the triangles in the polygon mesh, we want to save the vertexList.
-                itMeshPolygon.getTriangles(pointArray, vertexList, space)
-
-                # Add the vert list to the variable.
-                self.trianglesInVolume = self.trianglesInVolume + [vertexList]
-
-                itMeshPolygon.next()
-            iterList.next()
+        # Creates an (M, 3) array, the vert numbers of each triangle.
+        self.trianglesInVolume = np.array([triangleVertices[i] for i in range(triangleVertices.length())],
+                                          dtype=np.int32).reshape(-1, 3)
 
     def getVolumeCenter(self):
-        # Start point of line, and end of line. Creates a matrix.
-        vertsToTest = []
-        volumeCenter = Vector([0, 0, 0])
-
-        vertCount = cmds.polyEvaluate(self.currentVolume, v=True)
-
-        while (vertCount > 0):
-            vertsToTest.append("%s.vtx[%i]" % (self.currentVolume, vertCount))
-            vertCount = vertCount - 1
-
-        for i in vertsToTest:
-            volumeCenter = volumeCenter + Vector(cmds.pointPosition(i))
-
-        volumeCenter = volumeCenter / Vector([len(vertsToTest), len(vertsToTest), len(vertsToTest)])
-
-        self.volumeCenter = volumeCenter
+        # The center of the volume is the average of all of its points, the end point of every line segment
+        # we test. Blending asks for the same centers for every vert in more than one volume, so each
+        # volume's center is only worked out once.
+        if self.currentVolume not in self.volumeCenterCache:
+            self.volumeCenterCache[self.currentVolume] = self.getMeshPoints(self.currentVolume).mean(axis=0)
+        self.volumeCenter = self.volumeCenterCache[self.currentVolume]
 
     def startProgressBar(self):
         totalCyclesForVolume = len(self.vertsInBoundingBox) + len(self.trianglesInVolume)
@@ -361,133 +428,174 @@ class MeshVolume(object):
         cmds.progressBar(self.gMainProgressBar, edit=True, beginProgress=True, isInterruptable=False,
                          status="Calculating verts in Volume " + self.currentVolume, maxValue=totalCyclesForVolume)
 
-    def getPlaneNormals(self):
-        # Calculate the normal of the plane we are going to test, returns matrix
+    def getTriangleGeometry(self):
+        # Calculate the normals and plane constants of every triangle in the volume at once.
         # I can't get the normals from Maya correctly, so I have to do it the hard way
         # Formula for getting Normals:
         # Get the 2 vectors: Vector1 = vertB - vertA	Vector2 = vertC - vertA
         # Cross product of Vector1 and Vector2 gets us [NormalX, NormalY, NormalZ]
-        vertA = Vector(cmds.pointPosition(self.triangleVerts[0]))
-        vertB = Vector(cmds.pointPosition(self.triangleVerts[1]))
-        vertC = Vector(cmds.pointPosition(self.triangleVerts[2]))
+        # The triangles don't move while we test a volume, so this only has to happen once per volume.
+        volumePoints = self.getMeshPoints(self.currentVolume)
+        triangleIndices = np.array(self.trianglesInVolume, dtype=np.int32).reshape(-1, 3)
+        trianglePoints = volumePoints[triangleIndices]
+
+        self.triVertA = trianglePoints[:, 0]
+        self.triVertB = trianglePoints[:, 1]
+        self.triVertC = trianglePoints[:, 2]
+
+        normals = np.cross(self.triVertB - self.triVertA, self.triVertC - self.triVertA)
+        # Degenerate triangles end up with nan normals, they fail every plane test and are never counted.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+
+        self.triangleNormals = normals
+        self.trianglePlaneDistances = np.einsum("ij,ij->i", normals, self.triVertA)
+
+    def buildTriangleGrid(self):
+        # Hash every triangle of the volume into a uniform grid of cells. A segment from a vert to the volume
+        # center only passes through a handful of cells, so only the triangles in those cells can be crossed.
+        # The cell size is the average diagonal of the triangle bounding boxes, most triangles land in a few cells.
+        triangleMins = np.minimum(np.minimum(self.triVertA, self.triVertB), self.triVertC)
+        triangleMaxs = np.maximum(np.maximum(self.triVertA, self.triVertB), self.triVertC)
+        cellSize = np.linalg.norm(triangleMaxs - triangleMins, axis=1).mean()
+        if not cellSize > 0:
+            cellSize = 1.0
+
+        minCells = np.floor(triangleMins / cellSize).astype(int)
+        maxCells = np.floor(triangleMaxs / cellSize).astype(int)
+
+        self.triangleGrid = {}
+        for triangle, (minCell, maxCell) in enumerate(zip(minCells.tolist(), maxCells.tolist())):
+            for i in range(minCell[0], maxCell[0] + 1):
+                for j in range(minCell[1], maxCell[1] + 1):
+                    for k in range(minCell[2], maxCell[2] + 1):
+                        self.triangleGrid.setdefault((i, j, k), []).append(triangle)
+        self.gridCellSize = cellSize
+
+    def getCandidateTriangles(self, origin):
+        # Walk the grid cells along the segment from the vert to the volume center (Amanatides-Woo) and
+        # gather the triangles stored in every cell the segment passes through.
+        cellSize = self.gridCellSize
+        origin = [float(x) for x in origin]
+        center = [float(x) for x in self.volumeCenter]
+
+        cell = [int(math.floor(x / cellSize)) for x in origin]
+        endCell = [int(math.floor(x / cellSize)) for x in center]
+        steps = [0, 0, 0]
+        tMax = [float("inf")] * 3
+        tDelta = [float("inf")] * 3
+        for axis in range(3):
+            direction = center[axis] - origin[axis]
+            if direction > 0:
+                steps[axis] = 1
+                tMax[axis] = ((cell[axis] + 1) * cellSize - origin[axis]) / direction
+                tDelta[axis] = cellSize / direction
+            elif direction < 0:
+                steps[axis] = -1
+                tMax[axis] = (cell[axis] * cellSize - origin[axis]) / direction
+                tDelta[axis] = -cellSize / direction
+
+        candidates = set()
+        # The segment can't pass through more cells than it takes to step from one end to the other.
+        for _ in range(sum(abs(end - start) for start, end in zip(cell, endCell)) + 1):
+            candidates.update(self.triangleGrid.get(tuple(cell), ()))
+            axis = tMax.index(min(tMax))
+            if tMax[axis] > 1.0:
+                break
+            cell[axis] += steps[axis]
+            tMax[axis] += tDelta[axis]
+        return candidates
+
+    def testCollision(self, vertIndices, triangles):
+        # Every vert in the bounding box casts a line segment to the volume center, count the verts whose
+        # segment crosses a triangle. vertIndices index into the bounding box verts, triangles is either a
+        # single triangle tested against all of them, or one triangle per vert to test (vert, triangle) pairs.
+        vertA = self.triVertA[triangles]
+        normal = self.triangleNormals[triangles]
+        planeDistance = self.trianglePlaneDistances[triangles]
+        volumeCenter = np.asarray(self.volumeCenter)
+        origins = self.bbVertPositions[vertIndices]
 
-        Vector1 = vertB - vertA
-        Vector2 = vertC - vertA
+        # Test for early outs.
+        # If the vert and the volume center are on the same side of the triangle's plane, the segment
+        # can never cross it.
+        vertSides = (origins * normal).sum(axis=-1) - planeDistance
+        centerSide = (volumeCenter * normal).sum(axis=-1) - planeDistance
+        candidates = np.flatnonzero(vertSides * centerSide <= 0)
+        if not len(candidates):
+            return
 
-        Normal = cross_product(Vector1, Vector2)
-        Normal = normalizeNormal(Normal)
+        if np.ndim(triangles):
+            vertA = vertA[candidates]
+            triangles = np.asarray(triangles)[candidates]
 
-        self.triangleNormal = Normal
+        origins = origins[candidates]
+        hits = ray_hits_triangle(origins, volumeCenter - origins, vertA,
+                                 self.triVertB[triangles], self.triVertC[triangles])
 
-    def earlyOuts(self):
-        # Test for early outs.
-        # Are we on the backfacing side? If so, we'll never collide, return 0
-        self.meshVert = Vector(cmds.pointPosition(self.currentVert))
-        self.triVertA = Vector(cmds.pointPosition(self.triangleVerts[0]))
-        self.triVertB = Vector(cmds.pointPosition(self.triangleVerts[1]))
-        self.triVertC = Vector(cmds.pointPosition(self.triangleVerts[2]))
-        self.triNormalVector = Vector(self.triangleNormal)
-        self.volCenterVector = Vector(self.volumeCenter)
-
-        if (dot_product(self.meshVert, self.triNormalVector) - dot_product(self.triVertA,
-                                                                           self.triNormalVector)) < 0 and (
-                dot_product(self.volCenterVector, self.triNormalVector) - dot_product(self.triVertA,
-                                                                                      self.triNormalVector)) < 0:
-            return False
-        if (dot_product(self.meshVert, self.triNormalVector) - dot_product(self.triVertA,
-                                                                           self.triNormalVector)) > 0 and (
-                dot_product(self.volCenterVector, self.triNormalVector) - dot_product(self.triVertA,
-                                                                                      self.triNormalVector)) > 0:
-            return False
-
-        return True
-
-    def lineSegmentPlaneIntersection(self):
-        # Test to see if the line intersects with the plane and at what point.
-        meshVertToOrigin = dot_product(self.triNormalVector, self.meshVert)
-        triVertAToOrigin = dot_product(self.triNormalVector, self.triVertA)
-
-        distToMesh = (meshVertToOrigin - triVertAToOrigin)
-
-        lineSegment = (self.volCenterVector - self.meshVert)
-
-        rayToCenter = dot_product(self.triNormalVector, lineSegment)
-
-        distMid = -(distToMesh / rayToCenter)
-
-        distMid = Vector([distMid, distMid, distMid])
-
-        self.intersectPoint = self.meshVert + distMid + lineSegment
-
-    def halfSpaceTest(self, normal, planePoint):
-        vectorToPoint = self.intersectPoint - planePoint
-        distanceToPlane = dot_product(normal, vectorToPoint)
-        if distanceToPlane > 0:
-            return "Positive"
-        if distanceToPlane < 0:
-            return "Negative"
-        if distanceToPlane == 0:
-            return "OnPlane"
-
-    def lineSegmentTriangleIntersection(self):
-        # Check to see if intersectPoint is inside the triangle.
-        Edge0 = self.triVertB - self.triVertA
-        Normal0 = cross_product(Edge0, self.triNormalVector)
-
-        if self.halfSpaceTest(Normal0, self.triVertA) == "Positive":
-            return False
-
-        Edge1 = self.triVertC - self.triVertB
-        Normal1 = cross_product(Edge1, self.triNormalVector)
-        if self.halfSpaceTest(Normal1, self.triVertB) == "Positive":
-            return False
-
-        Edge2 = self.triVertA - self.triVertC
-        Normal2 = cross_product(Edge2, self.triNormalVector)
-        if self.halfSpaceTest(Normal2, self.triVertC) == "Positive":
-            return False
-
-        return True
-
-    def testCollision(self):
-        for singleSkinnedVert in self.vertsInBoundingBox:
-            self.currentVert = singleSkinnedVert
-
-            # Test for early outs.
-            if not self.earlyOuts():
-                continue
+        # A vert can show up more than once when testing pairs, add.at counts every one of them.
+        np.add.at(self.intersectCount, np.asarray(vertIndices)[candidates[hits]], 1)
 
-            # Find the intersection point of the plane, return self.intersectPoint
-            self.lineSegmentPlaneIntersection()
+    def setupCollision(self):
+        # With numba every vert is tested against every triangle in one compiled, multithreaded kernel.
+        if count_hits is not None:
+            self.intersectCount = count_hits(self.bbVertPositions, np.asarray(self.volumeCenter, dtype=np.float64),
+                                             self.triVertA, self.triVertB, self.triVertC)
+            cmds.progressBar(self.gMainProgressBar, e=True,
+                             step=len(self.vertsInBoundingBox) + len(self.trianglesInVolume))
+            return
 
-            if self.lineSegmentTriangleIntersection():
-                self.intersectCount[self.currentVert] = self.intersectCount[self.currentVert] + 1
+        allVerts = np.arange(len(self.vertsInBoundingBox))
 
-    def setupCollision(self):
-        for triangle in self.trianglesInVolume:
-            self.currentTriangle = triangle
+        # Small volumes are quicker to test a triangle at a time against every vert.
+        if len(self.trianglesInVolume) < GRID_MIN_TRIANGLES:
+            for triangle in range(len(self.trianglesInVolume)):
+                self.testCollision(allVerts, triangle)
 
-            # Convert our vert list for our current triangle vert indices into maya's vertex names. "MeshName.vtx[1]" etc.
-            self.triangleVerts = ["%s.vtx[%i]" % (self.currentVolume, self.currentTriangle[0]),
-                                  "%s.vtx[%i]" % (self.currentVolume, self.currentTriangle[1]),
-                                  "%s.vtx[%i]" % (self.currentVolume, self.currentTriangle[2])]
+                # Step progress Bar Forward
+                if not (triangle + 1) % PROGRESS_STEP:
+                    cmds.progressBar(self.gMainProgressBar, e=True, step=PROGRESS_STEP)
+            cmds.progressBar(self.gMainProgressBar, e=True, step=len(self.trianglesInVolume) % PROGRESS_STEP)
+            return
 
-            self.getPlaneNormals()
-            self.testCollision()
+        # Otherwise only test each vert against the triangles near its segment, all the pairs at once.
+        self.buildTriangleGrid()
+        pairVerts = []
+        pairTriangles = []
+        for vert in allVerts.tolist():
+            candidates = self.getCandidateTriangles(self.bbVertPositions[vert])
+            pairVerts.extend([vert] * len(candidates))
+            pairTriangles.extend(candidates)
 
             # Step progress Bar Forward
-            cmds.progressBar(self.gMainProgressBar, e=True, step=1)
+            if not (vert + 1) % PROGRESS_STEP:
+                cmds.progressBar(self.gMainProgressBar, e=True, step=PROGRESS_STEP)
+
+        if pairVerts:
+            self.testCollision(np.array(pairVerts), np.array(pairTriangles))
+        cmds.progressBar(self.gMainProgressBar, e=True,
+                         step=len(allVerts) % PROGRESS_STEP + len(self.trianglesInVolume))
+
+    def checkContainment(self):
+        # trimesh does the whole point in mesh test for us, ray casting against embree's BVH in native code.
+        # Creates self.insideVolume, a mask of the verts in the bounding box that are inside the volume.
+        triangleIndices = np.array(self.trianglesInVolume, dtype=np.int32).reshape(-1, 3)
+        volumeMesh = trimesh.Trimesh(vertices=self.getMeshPoints(self.currentVolume), faces=triangleIndices,
+                                     process=False)
+        self.insideVolume = volumeMesh.contains(self.bbVertPositions)
 
     def checkCollisionCount(self):
         # Check to see if the vert intersected an even number, or 0 times.
-        for vert in self.intersectCount.items():
-            vertName = vert[0]
-            count = vert[1]
-            if not count % 2 or count == 0:
-                # This checks to make sure the jointname is not already in
-                # allverts, then creates a list of the joint name, and the volume
-                if self.jointName not in self.allVerts[vertName]:
-                    self.allVerts[vertName] = self.allVerts[vertName] + [(self.jointName, self.currentVolume)]
+        # Creates self.insideVolume, a mask of the verts in the bounding box that are inside the volume.
+        self.insideVolume = (self.intersectCount & 1) == 0
+
+    def addVertsInVolume(self):
+        # Add the verts that are inside the current volume to self.allVerts.
+        for vertIndex in self.vertsInBoundingBox[self.insideVolume].tolist():
+            # This checks to make sure the jointname is not already in
+            # allverts, then creates a list of the joint name, and the volume
+            if self.jointName not in self.allVerts[vertIndex]:
+                self.allVerts[vertIndex] = self.allVerts[vertIndex] + [(self.jointName, self.currentVolume)]
 
     def checkAllVolumes(self):
         # Check to see if there are any verts in all volumes, based on the skinned mesh that we are working
@@ -499,11 +607,10 @@ class MeshVolume(object):
             # Create an empty list that will be filled with all of the verts that are within a volume later.
             self.vertsInCurrentVolume = []
 
-            # Seperate the name of the volume by its underscore, that way we can extract the name
-            # of the joint that it affects. It is important that the user created correctly named
+            # The name of the joint that the volume affects was extracted from the volume's name
+            # in getVolumesInScene. It is important that the user created correctly named
             # joints or this will cause problems at this stage.
-            splitName = volume.split("_")
-            self.jointName = "_".join(splitName[3:-1])
+            self.jointName = self.volumeToJoint[volume]
 
             # See if the verts are within the bounding box of the volume,
             # Not in the bounding box? We can rule it out cheaply.
@@ -513,18 +620,29 @@ class MeshVolume(object):
             if len(self.vertsInBoundingBox) == 0:
                 continue
 
-            # Create dictionary self.intersectCount and fill it up with the verts in the bounding box,
-            # default the values to 0, we will add 1 to each key when the vert intersects a triangle of the current
-            # volume.
-            self.createDictOfIntersectCount()
-
             # Get a list of all triangles in the volume.
             # Creates variable self.trianglesInVolume
             self.getTrianglesInVolume()
 
+            # Without embree trimesh casts its rays in python, our own test is just as quick.
+            if has_embree:
+                # Let trimesh test the verts in the bounding box against the volume.
+                self.checkContainment()
+                self.addVertsInVolume()
+                continue
+
+            # Create the array self.intersectCount with a counter for each vert in the bounding box,
+            # default the values to 0, we will add 1 to a vert's counter when it intersects a triangle of the current
+            # volume.
+            self.createDictOfIntersectCount()
+
             # returns self.VolumeCenter
             self.getVolumeCenter()
 
+            # Creates the per triangle arrays self.triVertA/B/C, self.triangleNormals and
+            # self.trianglePlaneDistances
+            self.getTriangleGeometry()
+
             # Start the progress bar.
             self.startProgressBar()
 
@@ -537,36 +655,35 @@ class MeshVolume(object):
             # Test to see if the times a vert has intersected is divisible by 2 or if it's 0
             # then it's inside of the volume. Add it to the list of verts that are inside the volume.
             self.checkCollisionCount()
+            self.addVertsInVolume()
 
     def checkOverlap(self):
         # This test sees if the list of volumes that the vert is associated with is > 0
         # a vert is associated with a volume if it is inside of that volume.
-        # I am creating a new dictionary vertsInAllVolumes and associating the vert name
+        # I am creating a new dictionary vertsInAllVolumes and associating the vert index
         # with the list of joints and verts from allVerts dictionary.
         # allVerts was a placeholder to capture all of the verts, and it is easier to
         # create a new dictionary with verts inside of volumes than delete the entry
         # of a vert with no volumes associated with it.
         for vert in self.allVerts.items():
-            vertName = vert[0]
+            vertIndex = vert[0]
             volumeList = vert[1]
 
             if len(volumeList) > 0:
-                self.vertsInAllVolumes[vertName] = volumeList
+                self.vertsInAllVolumes[vertIndex] = volumeList
 
     def getDistanceToCenter(self):
         # Calculate the distance to the center of the volume.
-        testVert = Vector(cmds.pointPosition(self.vertName))
-        self.distanceToCenter = math.sqrt(
-            ((testVert[0] - self.volumeCenter[0]) ** 2) + ((testVert[0] - self.volumeCenter[0]) ** 2) + (
-                        (testVert[0] - self.volumeCenter[0]) ** 2))
+        testVert = self.vertPositions[self.vertIndex]
+        self.distanceToCenter = float(np.linalg.norm(testVert - self.volumeCenter))
 
     def getDistanceAndBlend(self):
         # take out the name of the joint, and the volume,
-        # put it in an empty dictionary to be used later
+        # and find how far the vert is from the center of each volume.
+        jointNames = []
+        distances = []
         for jointVolTupple in self.listOfJointsVolumes:
-            jointName = str(jointVolTupple[0])
-
-            self.volumeCenters[jointName] = []
+            jointNames.append(str(jointVolTupple[0]))
 
             self.currentVolume = jointVolTupple[1]
 
@@ -576,79 +693,55 @@ class MeshVolume(object):
             # Calculate the distance of the vert to the center.
             self.getDistanceToCenter()
 
-            # Append to the dictionary
-            self.volumeCenters[jointName] = self.volumeCenters[jointName] + [self.distanceToCenter]
-
-        totalDistances = 0.0
-        for val in self.volumeCenters.items():
-
-            jointName = str(val[0])
-
-            # This is a list of all of the volumes for this joint.
-            distances = val[1]
-            totalDistances = 0.0
-            for distance in distances:
-                totalDistances += distance
-
-        for val in self.volumeCenters.items():
-            jointName = str(val[0])
+            distances.append(self.distanceToCenter)
 
-            distances = val[1]
+        # Normalize the distances across every volume the vert is in.
+        distances = np.array(distances)
+        totalDistances = distances.sum()
+        if totalDistances > 0:
+            distances = distances / totalDistances
 
-            self.volumeCenters[jointName] = []
+        # Gaussian falloff
+        falloff = np.exp(-(distances / 2.0 * .1 ** 2.0))
 
-            for distance in distances:
-                self.volumeCenters[jointName] = self.volumeCenters[jointName] + [distance / totalDistances]
+        # if volumes of the same joint overlap, they will add to eachother
+        joints, jointIds = np.unique(jointNames, return_inverse=True)
+        jointTotals = np.zeros(len(joints))
+        np.add.at(jointTotals, jointIds, falloff)
 
-            self.jointsToNormalize = {jointName: 0.0}
-
-        self.allDistances = 0.0
-
-        for val in self.volumeCenters.items():
-
-            jointName = str(val[0])
-
-            # This is a list of all of the volumes for this joint.
-            distances = val[1]
-
-            totalVal = 0.0
-            for i in distances:
-                # Gaussian falloff
-                currentVal = math.exp(-(i / 2.0 * .1 ** 2.0))
-                # if volumes overlap, they will add to eachother
-                totalVal = totalVal + currentVal
-
-                self.jointsToNormalize[jointName] = totalVal
-
-                self.allDistances = self.allDistances + totalVal
+        self.jointsToNormalize = dict(zip(joints.tolist(), jointTotals.tolist()))
+        self.allDistances = float(jointTotals.sum())
 
         # Normalize weights
-        for val in self.jointsToNormalize.items():
-            jointName = str(val[0])
-
-            # This is the weight of the current joint
-            weight = val[1]
-
+        for jointName, weight in self.jointsToNormalize.items():
             self.jointsVal[jointName] = weight / self.allDistances
 
     def calculateBlend(self):
         self.vertInMultVolumes = []
-        for vert in self.vertsInAllVolumes.items():
-            self.listOfJointsVolumes = vert[1]
-            self.vertName = vert[0]
+
+        # Gather the weights of every vert first, then hand them all to the skin cluster at once.
+        influenceIndices = self.getSkinClusterInfluences()
+        vertsToWeight = sorted(self.vertsInAllVolumes)
+        weights = np.zeros((len(vertsToWeight), len(influenceIndices)))
+
+        for row, vertIndex in enumerate(vertsToWeight):
+            self.listOfJointsVolumes = self.vertsInAllVolumes[vertIndex]
+            self.vertIndex = vertIndex
 
             # Vert is inside only one volume.
             if len(self.listOfJointsVolumes) == 1:
-                cmds.skinPercent(self.skinClust, self.vertName,
-                                 transformValue=[(str(self.listOfJointsVolumes[0][0]), 1.0)])
+                weights[row, influenceIndices[str(self.listOfJointsVolumes[0][0])]] = 1.0
 
             # Vert is inside multiple volumes
             else:
-                self.vertInMultVolumes.append(self.vertName)
+                self.vertInMultVolumes.append(self.getVertName(self.vertIndex))
                 self.jointsVal = {}
-                self.volumeCenters = {}
                 self.getDistanceAndBlend()
-                cmds.skinPercent(self.skinClust, self.vertName, transformValue=self.jointsVal.items())
+                for jointName, weight in self.jointsVal.items():
+                    weights[row, influenceIndices[jointName]] = weight
+
+        if vertsToWeight:
+            self.setSkinWeights(vertsToWeight, weights)
 
         cmds.select(self.vertInMultVolumes)
 
@@ -665,9 +758,13 @@ class MeshVolume(object):
             # down the line.
             self.skinnedMesh = skinnedMesh
 
-            # Get all of the verts of the skinned mesh, create variable self.vertsOfSkinnedMesh
+            # Get all of the verts of the skinned mesh, create variable self.vertIndices
             self.getAllVerts()
 
+            # Fetch the position of every vert once, everything after this works on the array
+            # instead of asking maya for positions inside of loops.
+            self.vertPositions = self.getMeshPoints(self.skinnedMesh)[self.vertIndices]
+
             # create a dictionary with all of the verts as keys, and an empty list definition
             # that we will use later, creates self.allVerts
             self.createVertDictionary()
@@ -23,6 +23,17 @@ def parse_arguments():
         default="./models",
         help="Directory where models will be downloaded",
     )  # Prevents users from having to look for hugging face cache files after trying the script.
+    parser.add_argument(
+        "--target_triangles",
+        type=int,
+        default=None,
+        help="Decimate the depth mesh down to about this many triangles, e.g. 200000",
+    )
+    parser.add_argument(
+        "--use_onnx",
+        action="store_true",
+        help="Run the exported ONNX model with onnxruntime instead of the transformers model",
+    )
     return parser.parse_args()
 
 
@@ -43,10 +54,14 @@ def main():
         raise FileNotFoundError(f"Models directory {models_dir} does not exist")
 
     input_image = get_image(input_path)
-    depth_output = get_depth(input_image, models_dir)
+    depth_output = get_depth(input_image, models_dir, use_onnx=args.use_onnx)
     output_image = array_to_image(depth_output)
     output_image.save(output_path / f"{input_path.stem}_depth.png")
-    output_depth_mesh(depth_output, output_path / f"{input_path.stem}_depth.obj")
+    output_depth_mesh(
+        depth_output,
+        output_path / f"{input_path.stem}_depth.obj",
+        target_triangles=args.target_triangles,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+import numpy as np
+import torch
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+def resize_depth(predicted_depth: torch.Tensor, size: tuple) -> np.array:
+    """Resize a batch of predicted depths back to the size of their image.
+
+    Args:
+        predicted_depth: The (N x height x width) depths predicted by the model
+        size: The (width, height) size to resize to
+
+    Returns:
+        A (N x height x width) numpy array of the resized depths.
+    """
+    # Depths still on the GPU are resized there, on the CPU OpenCV is quicker than torch.
+    if predicted_depth.device.type == "cpu" and cv2 is not None:
+        return np.stack(
+            [
+                cv2.resize(depth, size, interpolation=cv2.INTER_CUBIC)
+                for depth in predicted_depth.numpy()
+            ]
+        )
+
+    prediction = torch.nn.functional.interpolate(
+        predicted_depth.unsqueeze(1),
+        size=size[::-1],
+        mode="bicubic",
+        align_corners=False,
+    )
+    return prediction.squeeze(1).cpu().numpy()
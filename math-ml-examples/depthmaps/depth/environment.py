@@ -15,8 +15,7 @@ def setup_environment(model_path: Path) -> dict:
 
     for name, model in models.items():
         cache_dir = model_path / name
-        if not cache_dir.exists():
-            cache_dir.mkdir()
+        cache_dir.mkdir(parents=True, exist_ok=True)
 
         model_paths[name] = cache_dir
 
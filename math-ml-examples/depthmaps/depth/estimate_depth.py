@@ -1,51 +1,219 @@
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 import torch
 from PIL import Image
+from depth.depth_transforms import resize_depth
 from depth.environment import setup_environment, models
+from depth.onnx_depth import get_depth_onnx, onnx_model_path, onnxruntime
 from transformers import AutoImageProcessor, AutoModelForDepthEstimation
 
+# Loaded image processors and models, keyed by (model_name, model_cache) so every call after the first one
+# skips reading the weights from disk.
+_MODEL_CACHE: Dict[Tuple[str, str], tuple] = {}
+
+# Rough GPU memory one image needs in a forward pass, and the share of free memory we leave alone.
+_MEMORY_PER_IMAGE = 1024**3
+_MEMORY_MARGIN = 0.2
+# The most images we put through the model at once, also the batch size when running on the CPU.
+_MAX_BATCH_SIZE = 16
+# The input size the compiled model is warmed up with.
+_WARMUP_SIZE = 518
+
+
+def load_model(model_name: str, model_cache: Path) -> tuple:
+    """Load the image processor and depth model, or return them from the cache if they are already loaded.
+
+    Args:
+        model_name: The hugging face name of the model
+        model_cache: The directory the model is downloaded to
+
+    Returns:
+        A tuple of the image processor and the model, ready for half precision inference on the GPU if there is one.
+    """
+    key = (model_name, str(model_cache))
+    if key not in _MODEL_CACHE:
+        image_processor = AutoImageProcessor.from_pretrained(
+            model_name, cache_dir=model_cache
+        )
+        # Half precision runs the attention matmuls on the tensor cores and halves the activation memory.
+        # The weights are loaded straight into that dtype and onto the GPU, instead of being
+        # materialized in full precision in CPU memory first.
+        use_cuda = torch.cuda.is_available()
+        model = AutoModelForDepthEstimation.from_pretrained(
+            model_name,
+            cache_dir=model_cache,
+            torch_dtype=torch.float16 if use_cuda else torch.float32,
+            low_cpu_mem_usage=True,
+            device_map="cuda" if use_cuda else None,
+        ).eval()
+        if use_cuda and hasattr(torch, "compile"):
+            model = compile_model(model)
+        _MODEL_CACHE[key] = (image_processor, model)
+    return _MODEL_CACHE[key]
+
+
+def compile_model(model: torch.nn.Module) -> torch.nn.Module:
+    """Compile the model with torch.compile so its many small ops are fused into fewer GPU kernels.
+
+    Args:
+        model: The loaded depth model, on the GPU
+
+    Returns:
+        The compiled model, already warmed up so the first real image doesn't pay for the compilation.
+    """
+    model = torch.compile(model, mode="reduce-overhead", fullgraph=False)
+
+    # Depth anything's image processor resizes images to around 518 pixels, compile for that size up front.
+    dummy_input = torch.zeros(
+        1, 3, _WARMUP_SIZE, _WARMUP_SIZE, device=model.device, dtype=model.dtype
+    )
+    with torch.inference_mode(), torch.autocast(
+        device_type="cuda", dtype=torch.float16
+    ):
+        model(pixel_values=dummy_input)
+    return model
+
+
+def batch_size(model: torch.nn.Module, image_count: int) -> int:
+    """Pick how many images to run through the model at once.
+
+    Args:
+        model: The loaded depth model
+        image_count: The number of images waiting to be processed
+
+    Returns:
+        The largest batch that fits in the free GPU memory, capped at the number of images.
+    """
+    size = min(image_count, _MAX_BATCH_SIZE)
+    if model.device.type == "cuda":
+        free_memory, _ = torch.cuda.mem_get_info(model.device)
+        size = min(size, int(free_memory * (1 - _MEMORY_MARGIN) // _MEMORY_PER_IMAGE))
+    return max(size, 1)
+
+
+def preprocess_images(
+    image_processor: AutoImageProcessor, images: List[Image.Image], pin_memory: bool
+) -> dict:
+    """Turn a batch of images into model inputs on the CPU.
+
+    Args:
+        image_processor: The image processor loaded with the model
+        images: The images to process, all of the same size
+        pin_memory: If True, put the inputs in pinned memory so they can be copied to the GPU asynchronously
+
+    Returns:
+        A dictionary of the model's input tensors
+    """
+    inputs = image_processor(images=images, return_tensors="pt")
+    if pin_memory:
+        return {name: tensor.pin_memory() for name, tensor in inputs.items()}
+    return dict(inputs)
+
 
 def get_depth(
-    image: Image, models_dir: Path, model_type: str = "depth_anything"
-) -> np.array:
+    images: Union[Image.Image, List[Image.Image]],
+    models_dir: Path,
+    model_type: str = "depth_anything",
+    use_onnx: bool = False,
+) -> Union[np.array, List[np.array]]:
     """Get the depth images from the input data.
 
     Args:
-        image: The image to depth
+        images: The image to depth, or a list of images to depth in batches
         models_dir: The path to the models directory
         model_type: The string name for the model type as defined by depth.environment.setup_environment(...)
+        use_onnx: If True, run the exported ONNX model with onnxruntime instead, see depth.onnx_depth.export_onnx(...).
+            It resizes images to a fixed square input, so its depths differ slightly from the default path.
 
     Returns:
-        A 0-1 numpy array representing the depth estimation.
+        A 0-1 numpy array representing the depth estimation, or a list of them in the same order when given a list.
     """
+    single_image = isinstance(images, Image.Image)
+    if single_image:
+        images = [images]
+
+    if use_onnx:
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is required to use the ONNX model")
+        onnx_path = onnx_model_path(models_dir, model_type)
+        if not onnx_path.exists():
+            raise FileNotFoundError(
+                f"ONNX model {onnx_path} does not exist, export it with depth.onnx_depth.export_onnx(...)"
+            )
+        outputs = [get_depth_onnx(image, onnx_path) for image in images]
+        return outputs[0] if single_image else outputs
+
     model_paths = setup_environment(models_dir)
 
     # For now we'll just use depth_anything
     model_cache = model_paths[model_type]
     model_name = models[model_type]
 
-    image_processor = AutoImageProcessor.from_pretrained(
-        model_name, cache_dir=model_cache
-    )
-    model = AutoModelForDepthEstimation.from_pretrained(
-        model_name, cache_dir=model_cache
-    )
+    image_processor, model = load_model(model_name, model_cache)
 
-    inputs = image_processor(images=image, return_tensors="pt")
+    # Images of the same size are batched together, they give the model inputs of the same shape and
+    # can be resized back to their original size together.
+    images_by_size = {}
+    for index, image in enumerate(images):
+        images_by_size.setdefault(image.size, []).append(index)
 
-    with torch.no_grad():
-        outputs = model(**inputs)
-        predicted_depth = outputs.predicted_depth
+    batches = []
+    for size, indices in images_by_size.items():
+        step = batch_size(model, len(indices))
+        for start in range(0, len(indices), step):
+            batches.append((size, indices[start : start + step]))
 
-    prediction = torch.nn.functional.interpolate(
-        predicted_depth.unsqueeze(1),
-        size=image.size[::-1],
-        mode="bicubic",
-        align_corners=False,
-    )
+    # While the model runs on one batch, the next batch is preprocessed on a worker thread. On the GPU the
+    # model runs on its own stream and the inputs are copied over from pinned memory without blocking.
+    use_cuda = model.device.type == "cuda"
+    stream = torch.cuda.Stream() if use_cuda else None
+
+    outputs = [None] * len(images)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = [
+            executor.submit(
+                preprocess_images,
+                image_processor,
+                [images[index] for index in batch],
+                use_cuda,
+            )
+            for _, batch in batches[:1]
+        ]
+        for position, (size, batch) in enumerate(batches):
+            inputs = pending.pop().result()
+            if position + 1 < len(batches):
+                pending.append(
+                    executor.submit(
+                        preprocess_images,
+                        image_processor,
+                        [images[index] for index in batches[position + 1][1]],
+                        use_cuda,
+                    )
+                )
+
+            with torch.cuda.stream(stream) if use_cuda else contextlib.nullcontext():
+                inputs = {
+                    name: tensor.to(
+                        model.device,
+                        dtype=model.dtype if tensor.is_floating_point() else None,
+                        non_blocking=True,
+                    )
+                    for name, tensor in inputs.items()
+                }
+
+                with torch.inference_mode(), torch.autocast(
+                    device_type=model.device.type,
+                    dtype=torch.float16,
+                    enabled=use_cuda,
+                ):
+                    predicted_depth = model(**inputs).predicted_depth.float()
+
+                # Store the numpy arrays
+                for index, depth in zip(batch, resize_depth(predicted_depth, size)):
+                    outputs[index] = depth
 
-    # Return the numpy array
-    output = prediction.squeeze().cpu().numpy()
-    return output
+    return outputs[0] if single_image else outputs
@@ -1,9 +1,53 @@
+from functools import lru_cache
+
 import numpy as np
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+def _fill_triangle_grid(height: int, width: int, triangles: np.array) -> np.array:
+    """Fill a preallocated (2(height-1)(width-1) x 3) array with the triangles of a grid.
+
+    Args:
+        height (int): The height of the grid
+        width (int): The width of the grid
+        triangles (np.array): The array to fill
+
+    Returns:
+        The filled triangles array
+    """
+    for x in prange(width - 1):
+        for y in range(height - 1):
+            # Each square is made of two triangles with vertices a,b,c and d,c,b
+            a = y * width + x
+            b = a + width
+            c = a + 1
+            d = b + 1
+            index = (x * (height - 1) + y) * 2
+            triangles[index, 0] = a
+            triangles[index, 1] = b
+            triangles[index, 2] = c
+            triangles[index + 1, 0] = d
+            triangles[index + 1, 1] = c
+            triangles[index + 1, 2] = b
+    return triangles
 
+
+# Without numba create_triangle_grid builds the grid with numpy instead.
+if njit is not None:
+    _fill_triangle_grid = njit(parallel=True, cache=True)(_fill_triangle_grid)
+
+
+@lru_cache(maxsize=8)
 def create_triangle_grid(height: int, width: int) -> np.array:
     """Create an array of indices representing vertices of triangles in a grid.
 
+    Grids are cached by size, every frame of the same size shares them, so the returned array is read only.
+
     Args:
         height (int): The height of the grid
         width (int): The width of the grid
@@ -11,8 +55,19 @@ def create_triangle_grid(height: int, width: int) -> np.array:
     Returns:
         A 2D numpy array of indices with shape (2(height-1)(width-1) x 3)
     """
+    if njit is not None:
+        # Fill the output in a single compiled pass, without any of the temporary grids below.
+        triangles = np.empty(((width - 1) * (height - 1) * 2, 3), dtype=np.int32)
+        triangles = _fill_triangle_grid(height, width, triangles)
+        triangles.flags.writeable = False
+        return triangles
+
     # Create the grid
-    x, y = np.meshgrid(np.arange(width - 1), np.arange(height - 1), indexing="ij")
+    x, y = np.meshgrid(
+        np.arange(width - 1, dtype=np.int32),
+        np.arange(height - 1, dtype=np.int32),
+        indexing="ij",
+    )
     # Each square is made of two triangles with vertices a,b,c and d,c,b
     a = y * width + x
     b = (y + 1) * width + x
@@ -22,9 +77,32 @@ def create_triangle_grid(height: int, width: int) -> np.array:
     triangles = np.transpose(triangles, (1, 2, 0)).reshape(
         (width - 1) * (height - 1) * 2, 3
     )
+    triangles.flags.writeable = False
     return triangles
 
 
+@lru_cache(maxsize=8)
+def pixel_grid(height: int, width: int) -> np.array:
+    """Create the homogeneous coordinates of every pixel in an image.
+
+    Grids are cached by size, every frame of the same size shares them, so the returned array is read only.
+
+    Args:
+        height (int): The height of the image
+        width (int): The width of the image
+
+    Returns:
+        A (height x width x 3) float32 numpy array holding [x, y, 1] for every pixel
+    """
+    # Fill one float32 buffer with [x, y, 1] for every pixel, the 1 is the axis for depth
+    coord = np.empty((height, width, 3), dtype=np.float32)
+    coord[:, :, 0] = np.arange(width, dtype=np.float32)[None, :]
+    coord[:, :, 1] = np.arange(height, dtype=np.float32)[:, None]
+    coord[:, :, 2] = 1.0
+    coord.flags.writeable = False
+    return coord
+
+
 def simple_intrinsics(height: int, width: int) -> np.array:
     """Create a simple camera intrinsics matrix.
 
@@ -39,14 +117,31 @@ def simple_intrinsics(height: int, width: int) -> np.array:
     fov_x = 63.5
     # Y is calculated from the aspect ratio
     fov_y = fov_x * (height / width)
-    near_z = 0.00001
-    far_z = 10000
     fx = width / (2 * np.tan(np.radians(fov_x) / 2))
     fy = height / (2 * np.tan(np.radians(fov_y) / 2))
     cx = width / 2
     cy = height / 2
-    z_clipping = (far_z + near_z) / (far_z - near_z)
-    return np.array([[fx, 0, cx], [0, fy, cy], [0, 0, z_clipping]])
+    return np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]], dtype=np.float32)
+
+
+def invert_intrinsics(intrinsics: np.array) -> np.array:
+    """Invert a camera intrinsics matrix.
+
+    Args:
+        intrinsics (np.array): The 3x3 camera intrinsics
+
+    Returns:
+        The 3x3 float32 inverse of the intrinsics
+    """
+    fx, skew, cx = intrinsics[0]
+    fy, cy = intrinsics[1, 1:]
+    # A pinhole camera without skew has a simple inverse, there's no need for a general matrix inverse.
+    if skew == 0 and intrinsics[1, 0] == 0 and tuple(intrinsics[2]) == (0, 0, 1):
+        return np.array(
+            [[1 / fx, 0, -cx / fx], [0, 1 / fy, -cy / fy], [0, 0, 1]],
+            dtype=np.float32,
+        )
+    return np.linalg.inv(intrinsics).astype(np.float32)
 
 
 def depth_to_point_cloud(
@@ -68,16 +163,14 @@ def depth_to_point_cloud(
     # Finally we can stack the x and y values with the depth values to create the point cloud
     height, width = depth.shape
 
-    x = np.arange(width)
-    y = np.arange(height)
-    grid = np.stack(np.meshgrid(x, y), -1)
-    coord = np.concatenate(
-        (grid, np.ones_like(grid)[:, :, [0]]), axis=-1
-    )  # Add an axis for depth
-    coord = coord.astype(np.float32)
+    coord = pixel_grid(height, width)
 
-    # Depth is the distance from the camera, so we need to invert it
-    depth = 255.0 - depth
+    depth = depth.astype(np.float32, copy=False)
+
+    # The cloud comes out in the wrong orientation so we need to flip it around.
+    # Invert y and z to get correct order of points for trimesh reconstruction.
+    # These points are also giant, so we need to scale them down, we pick .1 arbitrarily.
+    scale = np.array([0.1, -0.1, -0.1], dtype=np.float32)
 
     if intrinsics is not None or use_simple:
         # The real camera is looking through a lens and the depth map is calculated
@@ -88,30 +181,27 @@ def depth_to_point_cloud(
         if intrinsics is None:
             intrinsics = simple_intrinsics(height=height, width=width)
 
-        intrinsics_inverted = np.linalg.inv(intrinsics)
-        # We can use einsum to multiply the intrinsics by the coordinate grid
+        # Everything stays in float32, a float64 matrix would upcast the whole grid.
+        intrinsics_inverted = invert_intrinsics(intrinsics)
+        # We can use a matrix multiply of the coordinate grid by the transposed intrinsics,
+        # matmul hands the whole grid to BLAS in one call.
         # This will give us the x and y values in camera space
         # this is equivalent to
         # for i in range(height):
         #    for j in range(width):
         #        coord[i, j] = np.dot(intrinsics_inverted, coord[i, j])
-        point_cloud = np.einsum("ij,klj->kli", intrinsics_inverted, coord)
+        point_cloud = coord @ intrinsics_inverted.T
+        np.multiply(point_cloud, scale, out=point_cloud)
     else:
         # This calculation is good for converting a depth map to real 3d space for reconstruction such as a 3d print,
         # cnc, or an arbitrary camera. The shape will be correct but the depth will be very flat.
-        point_cloud = coord.copy()
-        for i in range(height):
-            for j in range(width):
-                point_cloud[i, j] = [j, i, depth[i, j]]
-
-    # This gives us a cloud with the points in the wrong orientation so we need to flip them around.
-    # Invert y and z to get correct order of points for trimesh reconstruction.
-    point_cloud[:, :, 1] *= -1
-    point_cloud[:, :, 2] *= -1
-
-    # These points are giant, so we need to scale them down, we pick .1 arbitrarily
-    point_cloud = point_cloud * 0.1
-
-    point_cloud = point_cloud.reshape(-1, 3)
-
-    return point_cloud
+        # coord already holds [x, y, 1] for every pixel, scale x and y straight into the cloud.
+        point_cloud = np.empty_like(coord)
+        np.multiply(coord[:, :, :2], scale[:2], out=point_cloud[:, :, :2])
+        # Depth is the distance from the camera, so we need to invert it, (255 - depth) * -0.1.
+        # That is the same as depth * 0.1 - 25.5 so the inversion is folded into the scale.
+        z = point_cloud[:, :, 2]
+        np.multiply(depth, np.float32(0.1), out=z)
+        z -= np.float32(25.5)
+
+    return point_cloud.reshape(-1, 3)
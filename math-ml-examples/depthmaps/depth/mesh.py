@@ -5,24 +5,44 @@ import trimesh
 from depth.geometry import depth_to_point_cloud, create_triangle_grid
 
 
-def depth_to_mesh(depth: np.array, intrinsics: np.array = None) -> trimesh.Trimesh:
+def depth_to_mesh(
+    depth: np.array, intrinsics: np.array = None, target_triangles: int = None
+) -> trimesh.Trimesh:
     """Create a mesh from the depth image.
     Args:
         depth (np.array): The depth image
         intrinsics (np.array): The camera intrinsics, used to adjust the points from camera space to world space
+        target_triangles (int): If given, decimate the mesh down to about this many triangles
     Returns:
         A trimesh object
     """
     # depth = np.rot90(depth, 3)  # Y Up
-    # Create the point cloud
-    point_cloud = depth_to_point_cloud(depth, intrinsics)
-    verts = point_cloud.reshape(-1, 3)
+    # Create the point cloud, it is already an (N x 3) array of vertices, flipped and scaled for trimesh.
+    verts = depth_to_point_cloud(depth, intrinsics)
     # Create the mesh
-    mesh = trimesh.Trimesh(vertices=verts, faces=create_triangle_grid(*depth.shape))
+    # Skip trimesh's processing and validation. The grid has no duplicate vertices to merge and no
+    # degenerate faces to remove, so either would only cost time.
+    mesh = trimesh.Trimesh(
+        vertices=verts,
+        faces=create_triangle_grid(*depth.shape),
+        process=False,
+        validate=False,
+    )
+    # There are two triangles per pixel, most of them lie on smooth surfaces and can be merged away.
+    if target_triangles is not None and len(mesh.faces) > target_triangles:
+        mesh = mesh.simplify_quadric_decimation(face_count=target_triangles)
     return mesh
 
 
-def output_depth_mesh(depth: np.array, output_path: pathlib.Path):
-    """Save the depth image to the output path."""
-    mesh = depth_to_mesh(depth)
+def output_depth_mesh(
+    depth: np.array, output_path: pathlib.Path, target_triangles: int = None
+):
+    """Save the depth image to the output path.
+
+    Args:
+        depth (np.array): The depth image
+        output_path (pathlib.Path): The path to save the mesh to
+        target_triangles (int): If given, decimate the mesh down to about this many triangles
+    """
+    mesh = depth_to_mesh(depth, target_triangles=target_triangles)
     mesh.export(str(output_path))
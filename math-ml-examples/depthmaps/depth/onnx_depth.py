@@ -0,0 +1,115 @@
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import torch
+from PIL import Image
+from depth.depth_transforms import resize_depth
+from depth.environment import setup_environment, models
+from transformers import AutoModelForDepthEstimation
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# The square size the exported model takes, depth anything is trained at 518x518.
+INPUT_SIZE = 518
+# Depth anything normalizes its inputs with the ImageNet mean and standard deviation.
+_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Inference sessions keyed by the model path, building a TensorRT engine takes a while so we only do it once.
+_SESSIONS: Dict[str, "onnxruntime.InferenceSession"] = {}
+
+
+def onnx_model_path(models_dir: Path, model_type: str = "depth_anything") -> Path:
+    """Get the path the exported ONNX model is saved to.
+
+    Args:
+        models_dir: The path to the models directory
+        model_type: The string name for the model type as defined by depth.environment.setup_environment(...)
+    """
+    return setup_environment(models_dir)[model_type] / f"{model_type}.onnx"
+
+
+def export_onnx(models_dir: Path, model_type: str = "depth_anything") -> Path:
+    """Export the depth model to ONNX so it can be run by onnxruntime and TensorRT.
+
+    Args:
+        models_dir: The path to the models directory
+        model_type: The string name for the model type as defined by depth.environment.setup_environment(...)
+
+    Returns:
+        The path of the exported model.
+    """
+    output_path = onnx_model_path(models_dir, model_type)
+    model = AutoModelForDepthEstimation.from_pretrained(
+        models[model_type], cache_dir=output_path.parent
+    ).eval()
+
+    dummy_input = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    torch.onnx.export(
+        model,
+        dummy_input,
+        str(output_path),
+        input_names=["pixel_values"],
+        output_names=["predicted_depth"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "predicted_depth": {0: "batch"}},
+        opset_version=17,
+    )
+    return output_path
+
+
+def load_session(model_path: Path) -> "onnxruntime.InferenceSession":
+    """Load an inference session for the exported model, or return it from the cache if it is already loaded.
+
+    TensorRT is used in half precision when it is available, then CUDA, then the CPU.
+
+    Args:
+        model_path: The path of the exported ONNX model
+    """
+    key = str(model_path)
+    if key not in _SESSIONS:
+        available = onnxruntime.get_available_providers()
+        providers = [
+            (
+                "TensorrtExecutionProvider",
+                {
+                    "trt_fp16_enable": True,
+                    "trt_engine_cache_enable": True,
+                    "trt_engine_cache_path": str(model_path.parent),
+                },
+            ),
+            ("CUDAExecutionProvider", {}),
+            ("CPUExecutionProvider", {}),
+        ]
+        _SESSIONS[key] = onnxruntime.InferenceSession(
+            key,
+            providers=[provider for provider in providers if provider[0] in available],
+        )
+    return _SESSIONS[key]
+
+
+def get_depth_onnx(image: Image.Image, model_path: Path) -> np.array:
+    """Get the depth image from the input data with the exported ONNX model.
+
+    Args:
+        image: The image to depth
+        model_path: The path of the exported ONNX model, see export_onnx(...)
+
+    Returns:
+        A 0-1 numpy array representing the depth estimation.
+    """
+    session = load_session(model_path)
+
+    # Resize to the model's input size, normalize, then move the channels first.
+    resized = image.convert("RGB").resize((INPUT_SIZE, INPUT_SIZE), Image.BICUBIC)
+    pixel_values = (np.asarray(resized, dtype=np.float32) / 255.0 - _MEAN) / _STD
+    pixel_values = pixel_values.transpose(2, 0, 1)[None]
+
+    (predicted_depth,) = session.run(
+        ["predicted_depth"], {"pixel_values": pixel_values}
+    )
+
+    return resize_depth(torch.from_numpy(predicted_depth), image.size)[0]
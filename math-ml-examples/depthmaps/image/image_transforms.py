@@ -4,6 +4,11 @@ from typing import Union
 import numpy as np
 from PIL import Image
 
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
 
 def get_image(input_path: Union[str, Path]) -> Image:
     """Open the image from the input path.
@@ -21,8 +26,10 @@ def array_to_image(array: np.array) -> Image:
     Args:
         array: The numpy array to convert to an image
     """
-    normalized = array / array.max()
-    formatted = (normalized * 255).astype(np.uint8)
+    # Normalize and scale to 0-255 in one pass, an all black array stays black instead of dividing by 0.
+    maximum = array.max()
+    scale = 255.0 / maximum if maximum > 0 else 0.0
+    formatted = (array * np.float32(scale)).astype(np.uint8)
     return Image.fromarray(formatted)
 
 
@@ -34,4 +41,9 @@ def upscale_image(image: Image, size: tuple) -> Image:
         size: The size to upscale to
     """
     # In future use GAN models to upscale the image.
+    if cv2 is not None:
+        # OpenCV's bicubic resize is vectorized and multithreaded, PIL's runs on a single thread.
+        return Image.fromarray(
+            cv2.resize(np.asarray(image), size, interpolation=cv2.INTER_CUBIC)
+        )
     return image.resize(size, Image.BICUBIC)